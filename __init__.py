@@ -1,5 +1,5 @@
-from .number   import T3Number, T3NumberFormatter, Bcd, Bin, Hex, NULL
+from .number   import T3Number, T3NumberFormatter, Bcd, Bin, Hex, HexView, NULL
 from .pattern  import T3Pattern, T3Match, MatchingFailure
-from .table    import T3Table, T3Field, T3Binding, T3Set, T3Bitmap, T3Bitset, T3TableContext, T3Repeater, T3List
+from .table    import T3Table, T3Field, T3Binding, T3LazyValue, T3Set, T3Packrat, T3Bitmap, T3Bitset, T3TableContext, T3Repeater, T3PushParser, T3List
 from .testcase import T3TestCase
 
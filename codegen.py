@@ -0,0 +1,710 @@
+'''
+Source code generation of specialized matchers and unparsers for T3Table schemas.
+
+A generated matcher has the same signature as ``T3Table.match`` and returns an equal
+T3Match. Field offsets, literals and bitmap masks are inlined, nested tables and repeaters
+are unrolled into the same function. Whatever can't be compiled is delegated to the
+interpreting matcher at runtime, so the compiled function can always be swapped in.
+
+A generated unparser f computes f(**fields) == Hex(table(**fields)) without copying the
+prototype.
+'''
+
+__all__ = ["compile_matcher", "compile_unparser"]
+
+import sys
+import binascii
+import linecache
+import itertools
+import functools
+from copy import copy
+
+import t3.pattern
+from t3.pattern import T3Pattern, T3Match
+from t3.pattern import T3PatternSection, T3PatternValue, T3PatternAlt, T3PatternAny, T3PatternFunction
+from t3.number import T3Number, T3Value, Hex, HexView, Bin, NULL
+from t3.util.six import integer_types
+
+_file_counter = itertools.count()
+
+class _NoMatch(Exception):
+    "raised by generated code when the data does not match"
+
+class _Unsupported(Exception):
+    "raised by generated code when it leaves the compilable subset"
+
+########################### runtime helpers ######################################
+
+def _hex(s):
+    if not s:
+        return NULL
+    h = object.__new__(Hex)
+    h.base = 16
+    h._str = s
+    h._int = int(s, 16)
+    return h
+
+def _bin(s):
+    if not s:
+        return NULL
+    b = object.__new__(Bin)
+    b.base = 2
+    b._str = s
+    b._int = int(s, 2)
+    return b
+
+def _advance(s, rest, L):
+    '''
+    Returns the position in s where the rest of a match delegated to a T3Pattern starts.
+    '''
+    if not isinstance(rest, T3Number):
+        raise _Unsupported
+    if rest.base == 16:
+        # the length of a HexView is known without computing its digits
+        return L - 2*len(rest)
+    if len(rest) == 0:
+        return L
+    raise _Unsupported
+
+def _dispatch(P, d, s, pos, L):
+    '''
+    Matches the pattern description P returned by a size callback. Integer sizes are
+    handled inline, everything else is passed to the pattern which is created by
+    pattern_factory(P).
+    '''
+    if isinstance(P, integer_types):
+        e = pos + 2*P
+        if e > L:
+            raise _NoMatch
+        return _hex(s[pos:e]), e
+    if not isinstance(P, T3Pattern) and not hasattr(P, "__call__"):
+        if P == "*":
+            raise _Unsupported
+        if hasattr(P, "__int__"):
+            return _dispatch(int(P), d, s, pos, L)
+    m = t3.pattern.pattern_factory(P).match(d)
+    if m.fail:
+        raise _NoMatch
+    return m.value, _advance(s, m.rest, L)
+
+########################### generator ############################################
+
+def _is_section(P):
+    return isinstance(P, T3PatternSection) and hasattr(P.count, "__int__")
+
+def _literal(P):
+    try:
+        return Hex(P.value).digits()
+    except (TypeError, ValueError):
+        return None
+
+class _Generator(object):
+    def __init__(self):
+        self.lines     = []
+        self.namespace = {"_hex": _hex,
+                          "_unhexlify": binascii.unhexlify,
+                          "_HexView": HexView,
+                          "_Unsupported": _Unsupported,
+                          "_NULL": NULL}
+        self.counter   = itertools.count()
+
+    def new(self, prefix):
+        return "%s%d"%(prefix, next(self.counter))
+
+    def const(self, obj, prefix = "C"):
+        name = self.new(prefix)
+        self.namespace[name] = obj
+        return name
+
+    def emit(self, indent, line):
+        self.lines.append("    "*indent+line)
+
+    def source(self):
+        return "\n".join(self.lines)+"\n"
+
+    def build(self, name, debug):
+        source   = self.source()
+        filename = "<t3-compiled-%d>"%next(_file_counter)
+        # register source so that tracebacks and debuggers can show the generated code
+        linecache.cache[filename] = (len(source), None, source.splitlines(True), filename)
+        exec(compile(source, filename, "exec"), self.namespace)
+        function = self.namespace[name]
+        function.source = source
+        if debug:
+            sys.stdout.write(source)
+        return function
+
+class _MatcherGenerator(_Generator):
+    def __init__(self):
+        super(_MatcherGenerator, self).__init__()
+        self.namespace.update({"_bin": _bin,
+                               "_copy": copy,
+                               "_advance": _advance,
+                               "_dispatch": _dispatch,
+                               "_NoMatch": _NoMatch,
+                               "_T3Match": T3Match})
+        self.rest_none = False
+
+    # classification
+
+    def inlinable(self, table, nested = True):
+        from t3.table import T3Table, T3Bitmap
+        if not isinstance(table, T3Table) or isinstance(table, T3Bitmap):
+            return False
+        if getattr(type(table).match, "__func__", type(table).match) is not _table_match:
+            return False
+        if getattr(type(table)._coerce, "__func__", type(table)._coerce) is not _table_coerce:
+            return False
+        fields = [field for field in table._fields if field]
+        if not fields:
+            return False
+        if nested and isinstance(fields[-1].pattern, T3PatternAny):
+            return False
+        return True
+
+    def bitmap_inlinable(self, bitmap):
+        fields = [field for field in bitmap._fields if field]
+        if not fields or getattr(type(bitmap).match, "__func__", None) is not _bitmap_match:
+            return False
+        if not all(_is_section(field.pattern) for field in fields):
+            return False
+        total = sum(int(field.pattern.count) for field in fields)
+        return total>0 and total%8 == 0
+
+    # code generation
+
+    def gen_table(self, table, indent):
+        t  = self.new("t")
+        f  = self.new("f")
+        st = self.new("st")
+        self.emit(indent, "%s = _copy(%s)"%(t, self.const(table, "S")))
+        self.emit(indent, "%s = %s._fields"%(f, t))
+        self.emit(indent, "%s = pos"%st)
+        items = [(i, field) for (i, field) in enumerate(table._fields) if field]
+        self.gen_fields(t, f, items, indent)
+        if not self.rest_none:
+            # T3Table.match fails when the rest of the data equals the data
+            self.emit(indent, "if pos == %s or (pos < L and s[%s] == '0' and not s[%s:pos].strip('0')):"%(st, st, st))
+            self.emit(indent+1, "raise _NoMatch")
+        self.emit(indent, "%s._auto_parent()"%t)
+        self.emit(indent, "%s._set_matched()"%t)
+        return t
+
+    def gen_fields(self, t, f, items, indent):
+        k = 0
+        while k<len(items):
+            i, field = items[k]
+            P = field.pattern
+            if _is_section(P):
+                run = []
+                while k<len(items) and _is_section(items[k][1].pattern):
+                    run.append(items[k])
+                    k+=1
+                self.gen_sections(f, run, indent)
+                continue
+            if isinstance(P, T3PatternAny):
+                if k == len(items)-1:
+                    self.emit(indent, "%s[%d].value = _hex(s[pos:])"%(f, i))
+                    self.emit(indent, "pos = L")
+                    self.rest_none = True
+                else:
+                    self.gen_backtracking(t, f, i, items[k+1:], indent)
+                return
+            if isinstance(P, T3PatternValue) and _literal(P):
+                self.gen_literals(f, i, [_literal(P)], indent)
+            elif isinstance(P, T3PatternAlt) and all(isinstance(Q, T3PatternValue) and _literal(Q) for Q in P.patterns):
+                self.gen_literals(f, i, [_literal(Q) for Q in P.patterns], indent)
+            elif isinstance(P, T3PatternFunction):
+                d = self.gen_view(indent)
+                self.emit(indent, "%s[%d].value, pos = _dispatch(%s(%s, %s), %s, s, pos, L)"%(
+                    f, i, self.const(P.getpattern, "CB"), t, d, d))
+            elif self.inlinable(P):
+                sub = self.gen_table(P, indent)
+                self.emit(indent, "%s[%d].value = %s"%(f, i, sub))
+            elif isinstance(P, _bitmap_type()) and self.bitmap_inlinable(P):
+                sub = self.gen_bitmap(P, indent)
+                self.emit(indent, "%s[%d].value = %s"%(f, i, sub))
+            elif isinstance(P, _repeater_type()) and self.inlinable(P.table):
+                lst = self.gen_repeater(P, indent)
+                self.emit(indent, "%s[%d].value = %s"%(f, i, lst))
+            else:
+                self.gen_opaque(f, i, indent)
+            k+=1
+
+    def gen_sections(self, f, run, indent):
+        total = 2*sum(int(field.pattern.count) for (i, field) in run)
+        if total:
+            self.emit(indent, "if pos + %d > L:"%total)
+            self.emit(indent+1, "raise _NoMatch")
+        offset = 0
+        for i, field in run:
+            n = 2*int(field.pattern.count)
+            if n == 0:
+                self.emit(indent, "%s[%d].value = _NULL"%(f, i))
+            else:
+                start = "pos+%d"%offset if offset else "pos"
+                self.emit(indent, "%s[%d].value = _hex(s[%s:pos+%d])"%(f, i, start, offset+n))
+            offset+=n
+        if total:
+            self.emit(indent, "pos += %d"%total)
+
+    def gen_literals(self, f, i, literals, indent):
+        c = self.new("c")
+        alternatives = tuple((lit, int(lit, 16)) for lit in literals)
+        if len(alternatives) == 1:
+            lit, n = alternatives[0]
+            self.emit(indent, "%s = s[pos:pos+%d]"%(c, len(lit)))
+            self.emit(indent, "if %s != %r and (not %s or int(%s, 16) != %d):"%(c, lit, c, c, n))
+            self.emit(indent+1, "raise _NoMatch")
+        else:
+            lit, n = self.new("lit"), self.new("n")
+            self.emit(indent, "for %s, %s in %s:"%(lit, n, self.const(alternatives, "ALT")))
+            self.emit(indent+1, "%s = s[pos:pos+len(%s)]"%(c, lit))
+            self.emit(indent+1, "if %s == %s or (%s and int(%s, 16) == %s):"%(c, lit, c, c, n))
+            self.emit(indent+2, "break")
+            self.emit(indent, "else:")
+            self.emit(indent+1, "raise _NoMatch")
+        self.emit(indent, "%s[%d].value = _hex(%s)"%(f, i, c))
+        self.emit(indent, "pos += len(%s)"%c)
+
+    def gen_backtracking(self, t, f, i, items, indent):
+        p, k = self.new("p"), self.new("k")
+        self.emit(indent, "%s = pos"%p)
+        self.emit(indent, "for %s in range((L - %s)//2 - 1, -1, -1):"%(k, p))
+        self.emit(indent+1, "pos = %s + 2*%s"%(p, k))
+        self.emit(indent+1, "try:")
+        self.gen_fields(t, f, items, indent+2)
+        self.emit(indent+1, "except _NoMatch:")
+        self.emit(indent+2, "continue")
+        self.emit(indent+1, "break")
+        self.emit(indent, "else:")
+        self.emit(indent+1, "raise _NoMatch")
+        self.emit(indent, "%s[%d].value = _hex(s[%s:%s + 2*%s])"%(f, i, p, p, k))
+
+    def gen_bitmap(self, bitmap, indent):
+        items = [(i, field) for (i, field) in enumerate(bitmap._fields) if field]
+        total = sum(int(field.pattern.count) for (i, field) in items)
+        x, t, f = self.new("x"), self.new("t"), self.new("f")
+        self.emit(indent, "if pos + %d > L:"%(total//4))
+        self.emit(indent+1, "raise _NoMatch")
+        self.emit(indent, "%s = int(s[pos:pos+%d], 16)"%(x, total//4))
+        self.emit(indent, "pos += %d"%(total//4))
+        self.emit(indent, "if not %s and pos < L:"%x)
+        self.emit(indent+1, "raise _NoMatch")
+        # T3Bitmap.match keeps a rest of zero bits as a Bin object
+        self.emit(indent, "if pos < L and s[pos] == '0' and not s[pos:].strip('0'):")
+        self.emit(indent+1, "raise _Unsupported")
+        self.emit(indent, "%s = _copy(%s)"%(t, self.const(bitmap, "S")))
+        self.emit(indent, "%s = %s._fields"%(f, t))
+        shift = total
+        for i, field in items:
+            n = int(field.pattern.count)
+            shift-=n
+            if n == 0:
+                self.emit(indent, "%s[%d].value = _NULL"%(f, i))
+            else:
+                self.emit(indent, "%s[%d].value = _bin(format((%s >> %d) & %d, '0%db'))"%(f, i, x, shift, (1<<n)-1, n))
+        self.emit(indent, "%s._auto_parent()"%t)
+        self.emit(indent, "%s._set_matched()"%t)
+        return t
+
+    def gen_repeater(self, repeater, indent):
+        lst, n, p = self.new("lst"), self.new("n"), self.new("p")
+        self.emit(indent, "%s = %s()"%(lst, self.const(_list_type(), "T3List")))
+        self.emit(indent, "%s = 0"%n)
+        self.emit(indent, "while %s < %d:"%(n, repeater._max))
+        self.emit(indent+1, "%s = pos"%p)
+        self.emit(indent+1, "try:")
+        t = self.gen_table(repeater.table, indent+2)
+        self.emit(indent+1, "except _NoMatch:")
+        self.emit(indent+2, "pos = %s"%p)
+        self.emit(indent+2, "break")
+        self.emit(indent+1, "%s.append(%s)"%(lst, t))
+        self.emit(indent+1, "%s += 1"%n)
+        self.emit(indent, "if %s < %d:"%(n, repeater._min))
+        self.emit(indent+1, "raise _NoMatch")
+        return lst
+
+    def gen_view(self, indent):
+        # the rest of the data as a HexView of the bytes of s. Other than a Hex it is
+        # created without copying the rest, the bytes are converted once per call.
+        d = self.new("d")
+        self.emit(indent, "if buf is None:")
+        self.emit(indent+1, "buf = _unhexlify(s)")
+        self.emit(indent, "%s = _HexView.frombuffer(buf, pos//2)"%d)
+        return d
+
+    def gen_opaque(self, f, i, indent):
+        m = self.new("m")
+        d = self.gen_view(indent)
+        self.emit(indent, "%s = %s[%d].pattern.match(%s)"%(m, f, i, d))
+        self.emit(indent, "if %s.fail:"%m)
+        self.emit(indent+1, "raise _NoMatch")
+        self.emit(indent, "%s[%d].value = %s.value"%(f, i, m))
+        self.emit(indent, "pos = _advance(s, %s.rest, L)"%m)
+
+    # entry points
+
+    def gen_prologue(self, name, pattern, coerce):
+        self.namespace["_fallback"] = pattern.match
+        self.namespace["_coerce"]   = coerce
+        self.emit(0, "def %s(data):"%name)
+        self.emit(1, "data = _coerce(data)")
+        self.emit(1, "if not isinstance(data, _Hex) or data.base != 16:")
+        self.emit(2, "return _fallback(data)")
+        self.emit(1, "s = data._str")
+        self.emit(1, "L = len(s)")
+        self.emit(1, "pos = 0")
+        self.emit(1, "buf = None")
+        self.namespace["_Hex"] = Hex
+
+    def gen_table_matcher(self, table):
+        self.gen_prologue("match_table", table, table._coerce)
+        if not self.inlinable(table, nested = False):
+            self.emit(1, "return _fallback(data)")
+            return "match_table"
+        self.emit(1, "try:")
+        t = self.gen_table(table, 2)
+        self.emit(1, "except (_NoMatch, _Unsupported):")
+        self.emit(2, "return _fallback(data)")
+        if self.rest_none:
+            self.emit(1, "return _T3Match(%s, None)"%t)
+        else:
+            self.emit(1, "return _T3Match(%s, _hex(s[pos:]))"%t)
+        return "match_table"
+
+    def gen_repeater_matcher(self, repeater):
+        self.gen_prologue("match_repeater", repeater, repeater.table._coerce)
+        if not self.inlinable(repeater.table):
+            self.emit(1, "return _fallback(data)")
+            return "match_repeater"
+        self.emit(1, "try:")
+        lst = self.gen_repeater(repeater, 2)
+        self.emit(1, "except (_NoMatch, _Unsupported):")
+        self.emit(2, "return _fallback(data)")
+        self.emit(1, "return _T3Match(%s, _hex(s[pos:]))"%lst)
+        return "match_repeater"
+
+def _bitmap_type():
+    from t3.table import T3Bitmap
+    return T3Bitmap
+
+def _repeater_type():
+    from t3.table import T3Repeater
+    return T3Repeater
+
+def _list_type():
+    from t3.table import T3List
+    return T3List
+
+_table_match  = None
+_table_coerce = None
+_bitmap_match = None
+
+def compile_matcher(pattern, debug = False):
+    '''
+    Generates and compiles a match function for a T3Table or T3Repeater ``pattern``.
+
+    :param pattern: T3Table or T3Repeater schema. The schema is compiled as it is at the
+                    time of the call. Later modifications of the schema are not reflected
+                    in the generated function.
+    :param debug: if True the generated source is written to stdout.
+    :returns: function f with f(data) == pattern.match(data). The generated source is
+              available as f.source.
+    '''
+    global _table_match, _table_coerce, _bitmap_match
+    from t3.table import T3Table, T3Bitmap, T3Repeater
+    _table_match  = T3Table.__dict__["match"]
+    _table_coerce = T3Table.__dict__["_coerce"]
+    _bitmap_match = T3Bitmap.__dict__["match"]
+
+    gen = _MatcherGenerator()
+    if isinstance(pattern, T3Repeater):
+        name = gen.gen_repeater_matcher(pattern)
+    elif isinstance(pattern, T3Table):
+        name = gen.gen_table_matcher(pattern)
+    else:
+        raise TypeError("cannot compile object of type '%s'"%type(pattern))
+    return gen.build(name, debug)
+
+########################### unparse plans ########################################
+
+_MISSING = object()
+
+def _override(v, coerce):
+    '''
+    Converts a keyword argument of an unparser into a field value like T3Table._update does.
+    '''
+    from t3.table import T3Table, T3List, T3Field, T3Binding
+    if isinstance(v, (list, tuple)) and not isinstance(v, T3List):
+        if len(v)!=1:
+            raise _Unsupported
+        v = v[0]
+    if isinstance(v, (T3Field, T3Binding)):
+        raise _Unsupported
+    if v is None or isinstance(v, (T3List, T3Table)):
+        return v
+    return coerce(v)
+
+def _bind(callback, value, coerce):
+    from t3.table import T3Table
+    value = callback(value)
+    if isinstance(value, T3Table):
+        return value
+    return coerce(value)
+
+def _digits(v):
+    '''
+    Returns the hex digits a field value contributes to the value of its table.
+    '''
+    from t3.table import T3Bitmap
+    if v is None:
+        return ''
+    if isinstance(v, T3Bitmap):
+        v = Hex(v)
+    elif isinstance(v, T3Value):
+        v = v.get_value()
+    if not isinstance(v, T3Number):
+        raise _Unsupported
+    if v.base!=16:
+        if len(v) == 0:
+            return ''
+        raise _Unsupported
+    return v._str
+
+def _concat(values):
+    '''
+    Computes the value of a '*' binding from the values of the subsequent fields.
+    '''
+    if not values:
+        return NULL
+    if all(isinstance(v, T3Number) and (v.base == 16 or len(v) == 0) for v in values):
+        return _hex(''.join(v._str for v in values if len(v)))
+    return functools.reduce(lambda x, y: x // y, values)
+
+def _binding_order(table):
+    '''
+    Returns the indices of the bound fields of ``table`` in an order in which they can be
+    evaluated or None if a binding reads a field which doesn't exist.
+    '''
+    fields = table._fields
+    names  = set(field.name for field in fields)
+    for field in fields:
+        binding = field.value_binding
+        if binding and binding.name!="*" and binding.name not in names:
+            return None
+    return list(table._bindings)
+
+class _UnparserGenerator(_Generator):
+    def plannable(self, table):
+        from t3.table import T3Table
+        for method in ("get_value", "_coerce", "_update", "__call__"):
+            if getattr(getattr(type(table), method), "__func__", None) is not T3Table.__dict__[method]:
+                return False
+        names = [field.name for field in table._fields]
+        if table._parent is not None or len(set(names))!=len(names):
+            return False
+        for field in table._fields:
+            if field.value_binding and field.value_binding.name is None:
+                return False
+        return _binding_order(table) is not None
+
+    def constant(self, value):
+        try:
+            return _digits(value)
+        except _Unsupported:
+            return None
+
+    def gen_unparser(self, table):
+        self.namespace.update({"_fallback": lambda **fields: Hex(table(**fields)),
+                               "_MISSING": _MISSING,
+                               "_override": _override,
+                               "_digits": _digits,
+                               "_bind": _bind,
+                               "_concat": _concat,
+                               "_coerce": table._coerce,
+                               "_Hex": Hex})
+        self.emit(0, "def unparse(**fields):")
+        if not self.plannable(table):
+            self.emit(1, "return _fallback(**fields)")
+            return "unparse"
+        fields = table._fields
+        names  = self.const(frozenset(field.name for field in fields), "NAMES")
+        self.emit(1, "changed = bool(fields)")
+        self.emit(1, "if changed and not %s.issuperset(fields):"%names)
+        self.emit(2, "return _fallback(**fields)")
+        self.emit(1, "try:")
+        pieces = []
+        for i, field in enumerate(fields):
+            value = field.value
+            V, v  = self.const(value, "V"), "v%d"%i
+            self.emit(2, "%s = fields.get(%r, _MISSING)"%(v, field.name))
+            self.emit(2, "if %s is _MISSING:"%v)
+            if field.value_binding and value is not None:
+                if value is NULL:
+                    self.emit(3, "%s = _MISSING"%v)
+                else:
+                    self.emit(3, "%s = _MISSING if changed else %s"%(v, V))
+            else:
+                self.emit(3, "%s = %s"%(v, V))
+            self.emit(2, "else:")
+            self.emit(3, "%s = _override(%s, _coerce)"%(v, v))
+            if field.value_binding:
+                self.emit(3, "if %s is _NULL:"%v)
+                self.emit(4, "%s = _MISSING"%v)
+            digits = self.constant(value)
+            if digits is None:
+                pieces.append("_digits(%s)"%v)
+            else:
+                pieces.append("(%r if %s is %s else _digits(%s))"%(digits, v, V, v))
+        for i in _binding_order(table):
+            binding = fields[i].value_binding
+            if binding.name == "*":
+                arg = "_concat((%s))"%"".join("v%d, "%j for j in range(i+1, len(fields)))
+            else:
+                arg = "v%d"%[field.name for field in fields].index(binding.name)
+            self.emit(2, "if v%d is _MISSING:"%i)
+            self.emit(3, "v%d = _bind(%s, %s, _coerce)"%(i, self.const(binding.callback, "CB"), arg))
+        self.emit(2, "digits = ''.join((%s))"%"".join("%s, "%piece for piece in pieces))
+        self.emit(1, "except _Unsupported:")
+        self.emit(2, "return _fallback(**fields)")
+        self.emit(1, "if digits:")
+        self.emit(2, "return _hex(digits)")
+        self.emit(1, "return _Hex(_NULL)")
+        return "unparse"
+
+def compile_unparser(table, debug = False):
+    '''
+    Generates and compiles an unparse plan for the T3Table ``table``.
+
+    Field values which are not passed as arguments are written as literals, bindings are
+    evaluated in dependency order and the hex digits of all fields are joined once.
+
+    :param table: T3Table prototype. Later modifications of the table are not reflected
+                  in the generated function.
+    :param debug: if True the generated source is written to stdout.
+    :returns: function f with f(**fields) == Hex(table(**fields)). The generated source is
+              available as f.source.
+    '''
+    from t3.table import T3Table
+    if not isinstance(table, T3Table):
+        raise TypeError("cannot compile unparser for object of type '%s'"%type(table))
+    gen  = _UnparserGenerator()
+    name = gen.gen_unparser(table)
+    return gen.build(name, debug)
+
+########################################################################################
+#
+#        Tests
+#
+########################################################################################
+
+def _same(m1, m2):
+    import re
+    def tostring(value):
+        if hasattr(value, "_tostring"):
+            value = value._tostring()
+        else:
+            value = [v._tostring() for v in value]
+        return re.sub(" at 0x[0-9a-fA-F]+", "", str(value))
+    assert m1.fail == m2.fail, (m1, m2)
+    if not m1.fail:
+        assert m1.rest == m2.rest, (m1.rest, m2.rest)
+        assert tostring(m1.value) == tostring(m2.value)
+
+def test_tlv():
+    from t3.table import T3Repeater, _build_tlv
+    Tlv = _build_tlv()
+    match = Tlv.compile()
+    for data in ["A7 02 03 05 06", "9F 01 81 80 "+"00"*0x80, "A7 05 01", "00 01 00 00"]:
+        _same(match(data), Tlv.match(data))
+    TlvList = T3Repeater(Tlv, 2, 3)
+    match = TlvList.compile()
+    for data in ["A7 01 03 05 01 06 07 00 08 01 09", "A7 01 03", "A7 01 03 05 01 06 FF"]:
+        _same(match(data), TlvList.match(data))
+    # a size callback gets a view of the rest of the data, not a copy
+    from t3.table import T3Table
+    seen = []
+    Rec = T3Table().add(1, Len = 0).add(lambda rec, data: seen.append(data) or int(rec.Len), Data = 0)
+    match = T3Repeater(Rec).compile()
+    _same(match("01 AA 02 BB CC"), T3Repeater(Rec).match("01 AA 02 BB CC"))
+    assert all(isinstance(d, HexView) for d in seen[:2]) and [len(d) for d in seen[:2]] == [4, 2]
+
+def test_apdu():
+    from t3.table import T3Table, T3Binding, T3Bitmap, T3Repeater
+    RApdu = T3Table()
+    RApdu.add("*", Data = '00')
+    RApdu.add(1, Le = None)
+    RApdu.add(2, SW = '00 00')
+    match = RApdu.compile()
+    for data in ['00 01 02 00 67 90 00', '90 00', '00']:
+        _same(match(data), RApdu.match(data))
+    match = RApdu(Le = "00").compile()
+    _same(match('00 01 02 00 67 90 00'), RApdu(Le = "00").match('00 01 02 00 67 90 00'))
+
+    Cmd = T3Table()
+    Cmd.add("00|80", Cla = "00")
+    Cmd.add('A4', Ins = 'A4')
+    Cmd.add(T3Bitmap().add(3, X = 0).add(5, Y = 0), P1 = 0)
+    Cmd.add(T3Table().add(1, P2 = 0).add(1, Lc = 0), Tail = 0)
+    Cmd.add(T3Repeater(T3Table().add('3F', Mf = '3F').add(1, Id = 0), 1, 2), Path = 0)
+    match = Cmd.compile()
+    assert "_dispatch" not in match.source
+    for data in ['80 A4 2F 00 02 3F 00 3F 01 3F 02', '00 A4 2F 00 02 3F 00', '01 A4 2F 00 02 3F 00',
+                 '80 A4 00 00 02 3F 00', '80 A4 2F 00 02 3E 00', '80 A4 2F 00 02 3F 00 00 00']:
+        _same(match(data), Cmd.match(data))
+
+def test_dynamic():
+    from t3.table import T3Table, T3Set, _build_tlv
+    Tlv = _build_tlv()
+    T1 = Tlv(Tag = 0x78)
+    T2 = Tlv(Tag = 0xA6)
+    ts = T3Set()
+    ts.add(0x78, T1 = T1)
+    ts.add(0xA6, T2 = T2)
+    T = Tlv(Tag = 0x70, Value = ts)
+    match = T.compile()
+    for data in ['70 08 78 01 06 A6 03 01 02 04', '70 08 A6 03 01 02 04 78 01 06', '70 08 A6 03 01 02 04 79 01 06']:
+        _same(match(data), T.match(data))
+    tree = match('70 08 A6 03 01 02 04 78 01 06').value
+    tree.Value.T1.Value = '05 06'
+    assert Hex(tree) == '70 09 A6 03 01 02 04 78 02 05 06'
+
+def test_unparser():
+    from t3.table import T3Table, T3Binding, _build_tlv
+    def data_len(Data):
+        return Hex(len(Data))
+
+    Apdu = T3Table()
+    Apdu.add(1, Cla  = 0x00)
+    Apdu.add(1, Ins  = 0xA4)
+    Apdu.add(1, P1   = 0x00)
+    Apdu.add(1, P2   = 0x00)
+    Apdu.add(1, Lc   = T3Binding(data_len, "Data"))
+    Apdu.add("*", Data = "3F 00")
+    Apdu.add(1, Le = None)
+    unparse = Apdu.compile_unparser()
+    assert "_fallback(**fields)\n    try:" in unparse.source
+    for fields in [{}, {"Data": "3F 00 DF 01"}, {"P1": 4, "Data": "A0 00 00 00 03"}, {"Le": 0},
+                   {"Data": "00", "Lc": 5}]:
+        assert unparse(**fields) == Hex(Apdu(**fields)), fields
+    try:
+        unparse(Foo = 0)
+        assert False, "ValueError exception not raised"
+    except ValueError:
+        pass
+
+    Tlv = _build_tlv()
+    unparse = Tlv.compile_unparser()
+    assert unparse(Value = "00"*0x80) == Hex(Tlv(Value = "00"*0x80))
+    Tpl = Tlv(Tag = 0x70, Value = Tlv(Tag = 0x9F01, Value = "01 02"))
+    unparse = Tpl.compile_unparser()
+    assert unparse() == Hex(Tpl())
+    assert unparse(Tag = 0x71) == Hex(Tpl(Tag = 0x71))
+    assert unparse(Value = Tlv(Value = "01")) == Hex(Tpl(Value = Tlv(Value = "01")))
+
+if __name__ == '__main__':
+    test_tlv()
+    test_apdu()
+    test_dynamic()
+    test_unparser()
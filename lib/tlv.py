@@ -2,10 +2,15 @@
 This module defines a Tlv data structure
 '''
 
+import os
+import mmap
+import bisect
+import multiprocessing
 import t3
 from functools import reduce
-from t3 import T3Binding, T3Table, Hex, T3Repeater, T3Number, T3Set, T3Bitset, T3Bitmap, T3Match, T3List
-from collections import OrderedDict
+from t3 import T3Binding, T3LazyValue, T3Table, Hex, HexView, T3Repeater, T3Number, T3Set, T3Bitset, T3Bitmap, T3Match, T3List, MatchingFailure
+from t3.table import MAXSIZE, _map_file, _byte_length
+from collections import OrderedDict, deque
 
 ##############################  Tlv  ###########################################################
 
@@ -35,14 +40,36 @@ def value_size(tlv, data):
 def update_len(v):
     if v is None or v is T3Number.NULL:
         return 0x00
-    k = Hex(len(Hex(v)))
+    k = Hex(_byte_length(v))
     if k<0x80:
         return k
     return (0x80 + len(k)) // k
 
 
 class T3Tlv(T3Table): 
+    _index   = None
+    _indexed = False
+
+    def build_index(self):
+        '''
+        Builds an index tag -> Tlvs of this tree which is used by find_tag and find_tags.
+        After the tree was updated the index is rebuilt when it is used next.
+        '''
+        index = {}
+        nodes = [self]
+        while nodes:
+            tlv = nodes.pop()
+            index.setdefault(int(Hex(tlv.Tag)), []).append(tlv)
+            if isinstance(tlv.Value, T3List):
+                nodes.extend(reversed(tlv.Value))
+        self._index   = index
+        self._indexed = True
+        return self
+
     def find_tag(self, tag):
+        if self._indexed:
+            tlvs = self.find_tags(tag)
+            return tlvs[0] if tlvs else None
         if Hex(self.Tag) == tag:
             return self
         if isinstance(self.Value, T3List):
@@ -50,6 +77,144 @@ class T3Tlv(T3Table):
                 res = tlv.find_tag(tag)
                 if res:
                     return res
+
+    def find_tags(self, tag):
+        '''
+        :returns: list of all Tlvs of this tree with the given tag in depth first order.
+        '''
+        if self._index is None:
+            self.build_index()
+        return list(self._index.get(int(Hex(tag)), ()))
+
+    def _changed(self):
+        super(T3Tlv, self)._changed()
+        self._index = None
+
+class T3TlvList(T3Repeater):
+    '''
+    T3Repeater of Tlvs which can parse a file in parallel. The ``header`` table matches
+    the Tag and the Len of a Tlv. It is used to find the Tlv boundaries.
+
+    If ``index`` is True each matched Tlv gets a tag index. See ``T3Tlv.build_index``.
+    '''
+    def __init__(self, table, header, minimum = 1, maximum = MAXSIZE, index = False):
+        super(T3TlvList, self).__init__(table, minimum, maximum)
+        self.header = header
+        self.index  = index
+
+    def match(self, data, fields = None):
+        m = super(T3TlvList, self).match(data, fields)
+        if self.index and not m.fail:
+            for tlv in m.value:
+                tlv.build_index()
+        return m
+
+    def boundaries(self, data, maximum = MAXSIZE):
+        '''
+        :param data: T3Number
+        :param maximum: the number of offsets after which the scan stops.
+        :returns: list of the offsets of the Tlvs in data. Values are skipped by their
+                  length without being matched.
+        '''
+        offsets = []
+        pos = 0
+        n   = len(data)
+        while pos<n and len(offsets)<maximum:
+            m = self.header.match(data[pos:])
+            if m.fail:
+                break
+            offsets.append(pos)
+            pos = n - len(m.rest) + _value_len(m.value.Len)
+        return offsets
+
+    def parse_parallel(self, path, workers = None, iterator = False):
+        '''
+        Parses the Tlvs of a file in a pool of processes.
+
+        The file is cut at Tlv boundaries into shards which are parsed in parallel and
+        the Tlvs are merged in their order in the file.
+
+        :param path: path of a binary file.
+        :param workers: number of processes, by default the number of CPUs.
+        :param iterator: if True an iterator over the Tlvs is returned, otherwise a T3List.
+        :raises MatchingFailure: if fewer than ``minimum`` Tlvs are found.
+        '''
+        workers = workers or multiprocessing.cpu_count()
+        size    = os.path.getsize(path)
+        # the part of the file after the last of maximum Tlvs isn't parsed
+        offsets = self.boundaries(_map_file(path), self._max+1)
+        if len(offsets)>self._max:
+            size = offsets[self._max]
+            del offsets[self._max:]
+        tasks   = [(self.table, path, start, stop)
+                   for start, stop in _shards(offsets, size, 4*workers)]
+        tables  = _parse_shards(tasks, workers, self._min, self._max)
+        if iterator:
+            return tables
+        return T3List(tables)
+
+def _value_len(Len):
+    if Len[0] & 0x80 == 0x80:
+        return int(Len[1:])
+    else:
+        return int(Len)
+
+def _shards(offsets, size, count):
+    # cuts [0, size) at the offsets which are next to multiples of size/count
+    bounds = [0]
+    i = 0
+    for k in range(1, count):
+        i = bisect.bisect_left(offsets, k*size//count, i)
+        if i<len(offsets) and offsets[i]>bounds[-1]:
+            bounds.append(offsets[i])
+    if size>bounds[-1]:
+        bounds.append(size)
+    return list(zip(bounds, bounds[1:]))
+
+def _parse_shard(task):
+    table, path, start, stop = task
+    with open(path, "rb") as f:
+        buffer = mmap.mmap(f.fileno(), 0, access = mmap.ACCESS_READ)
+    m = T3Repeater(table, minimum = 0).match(HexView.frombuffer(buffer, start, stop))
+    return m.value, m.rest is None or len(m.rest) == 0
+
+def _submit_shards(pool, tasks, size):
+    # submits the shards while their results are consumed. At most ``size`` shards are
+    # pending, so a caller which stops early doesn't wait for the rest of the file.
+    pending = deque()
+    for task in tasks:
+        pending.append(pool.apply_async(_parse_shard, (task,)))
+        if len(pending)>=size:
+            yield pending.popleft().get()
+    while pending:
+        yield pending.popleft().get()
+
+def _parse_shards(tasks, workers, minimum, maximum):
+    if workers>1 and len(tasks)>1:
+        pool = multiprocessing.Pool(workers)
+        results = _submit_shards(pool, tasks, 2*workers)
+    else:
+        pool = None
+        results = (_parse_shard(task) for task in tasks)
+    try:
+        count = 0
+        for tables, complete in results:
+            for table in tables:
+                if count == maximum:
+                    return
+                yield table
+                count+=1
+            if not complete:
+                # a sequential parse stops at the first mismatch as well
+                break
+        if count<minimum:
+            raise MatchingFailure(T3Match(None, None, fail = True))
+    finally:
+        if pool is not None:
+            # the pending shards aren't needed any more
+            pool.terminate()
+            pool.join()
+
 Tlv = T3Tlv()
 Tlv.__doc__ = """
 T(ag) L(ength) V(alue) data structure
@@ -79,7 +244,7 @@ Tl.add(len_size, Len = "00")
 
 ##############################  List variants  ################################################
 
-TlvList = T3Repeater(Tlv)
+TlvList = T3TlvList(Tlv, Tl)
 LvList  = T3Repeater(Lv)
 TlList  = T3Repeater(Tl)
 
@@ -107,12 +272,19 @@ B2 = T3Bitmap()
 B2.add(1, Next = 0)
 B2.add(7, TagNumber = 0)
 
+class IncompleteMatcher(t3.pattern.T3Matcher):
+    # matcher of a field whose end isn't contained in data. More data is needed.
+    def match(self, data, table = None):
+        m = T3Match(None, data, fail = True)
+        m.need = 1
+        return m
+
 def long_form(tag, data):
     if tag.Head.TagNumber == 0x1F:
         for k in range(1, len(data)):
             if data[k] & 0x80 != 0x80:
-                break
-        return k
+                return k
+        return IncompleteMatcher()
     else:
         return 0
 
@@ -126,6 +298,10 @@ class TlvListMatcher(t3.pattern.T3Matcher):
 
     def match(self, data, table = None):
         size = self.size
+        if len(data)<size:
+            m = T3Match(None, data, fail = True)
+            m.need = size - len(data)
+            return m
         m = BERTlvList.match(data[:size])
         if m.fail:
             return m
@@ -148,7 +324,38 @@ BERTlv.add(BerTag, Tag = "00")
 BERTlv.add(len_size, Len = T3Binding(update_len, "Value"))
 BERTlv.add(primitive_or_constructed, Value = "00")
 
-BERTlvList = T3Repeater(BERTlv)
+BERTl = T3Table()
+BERTl.add(BerTag, Tag = "00")
+BERTl.add(len_size, Len = "00")
+
+BERTlvList = T3TlvList(BERTlv, BERTl)
+
+##############################  Lazy BER TLV  ################################################
+
+# The Value of a constructed LazyBERTlv keeps its bytes and is matched by LazyBERTlvList when
+# it is first accessed, e.g. by tlv.Value or find_tag. Serialization uses the kept bytes.
+
+class LazyTlvListMatcher(TlvListMatcher):
+    def match(self, data, table = None):
+        size = self.size
+        if len(data)<size:
+            m = T3Match(None, data, fail = True)
+            m.need = size - len(data)
+            return m
+        return T3Match(T3LazyValue(LazyBERTlvList, data[:size]), data[size:])
+
+def lazy_primitive_or_constructed(tlv, data):
+    P = primitive_or_constructed(tlv, data)
+    if isinstance(P, TlvListMatcher):
+        return LazyTlvListMatcher(P.size)
+    return P
+
+LazyBERTlv = T3Tlv()
+LazyBERTlv.add(BerTag, Tag = "00")
+LazyBERTlv.add(len_size, Len = T3Binding(update_len, "Value"))
+LazyBERTlv.add(lazy_primitive_or_constructed, Value = "00")
+
+LazyBERTlvList = T3TlvList(LazyBERTlv, BERTl)
 
 ###########################################################################################
 #
@@ -160,7 +367,7 @@ BERTlvList = T3Repeater(BERTlv)
 
 TlList = DOL = xDOL = T3Repeater(T3Table().add(tag_size, Tag = "00")
                                           .add(len_size, Len = "00"))
-TlvList = T3Repeater(Tlv)
+TlvList = T3TlvList(Tlv, Tl)
 LvList = T3Repeater(Lv)
 
 class TlvDict(OrderedDict):
@@ -186,6 +393,45 @@ def parse_with_dol(data, dol):
         offset += int(tl.Len)
     return tlvs
 
+def extract(tlv_tree, tags, multiple = False, template = None):
+    '''
+    Finds the values of several tags in one depth first traversal of a Tlv tree.
+
+    :param tlv_tree: a Tlv or a list of Tlvs.
+    :param tags: the tags to look for.
+    :param multiple: if True a tag is mapped onto the list of the values of all Tlvs
+                     with this tag. Otherwise it is mapped onto the value of the first
+                     Tlv and the traversal stops when all tags are found.
+    :param template: optional dict which maps a constructed tag onto the tags which can
+                     occur at any depth in its value. Subtrees which cannot contain a tag
+                     which is still searched are skipped; lazy values aren't decoded.
+    :returns: dict tag -> value or tag -> [value]. Tags which aren't found are missing.
+    '''
+    wanted = dict((int(Hex(tag)), tag) for tag in tags)
+    if template:
+        template = dict((int(Hex(tag)), set(int(Hex(t)) for t in inner))
+                        for (tag, inner) in template.items())
+    res = {}
+    if isinstance(tlv_tree, T3Table):
+        nodes = [tlv_tree]
+    else:
+        nodes = list(reversed(tlv_tree))
+    while nodes and wanted:
+        tlv = nodes.pop()
+        tag = int(Hex(tlv.Tag))
+        if tag in wanted:
+            if multiple:
+                res.setdefault(wanted[tag], []).append(tlv.Value)
+            else:
+                res[wanted.pop(tag)] = tlv.Value
+                if not wanted:
+                    break
+        if template and tag in template and template[tag].isdisjoint(wanted):
+            continue
+        if isinstance(tlv.Value, T3List):
+            nodes.extend(reversed(tlv.Value))
+    return res
+
 ######################################  Test #######################################
 
 def test_tag():
@@ -237,8 +483,181 @@ def test_tlv_concatenation():
     c.Value.pop()
     print Hex(c) == "62 06 82 01 10 83 01 92"
 
+def test_push_parser():
+    data = Hex("7F 05 03 80 01 00 80 02 00 00 62 06 82 01 10 83 01 92")
+    tlvs = BERTlvList << data
+    parser = BERTlvList.push_parser()
+    parsed = []
+    for i in range(len(data)):
+        parsed+=parser.feed(data[i:i+1])
+    parsed+=parser.close()
+    assert [Hex(tlv) for tlv in parsed] == [Hex(tlv) for tlv in tlvs]
+    assert parsed[2].find_tag("83").Value == 0x92
+    # a truncated tag fails to match
+    for data in ("9F 81 81", "70 03 9F 81 81"):
+        m = BERTlv.match(data)
+        assert m.fail and m.need == 1
+    tlvs = BERTlvList.match(Hex("5A 01 00 9F 81 81"))
+    assert len(tlvs.value) == 1 and tlvs.rest == "9F 81 81"
+
+def test_parse_parallel():
+    import tempfile
+    data = Hex("7F 05 03 80 01 00 80 02 00 00 62 06 82 01 10 83 01 92 "*50)
+    tlvs = [Hex(tlv) for tlv in BERTlvList << data]
+    assert BERTlvList.boundaries(data)[:4] == [0, 6, 10, 18]
+    fd, path = tempfile.mkstemp()
+    try:
+        os.write(fd, bytearray(data.ascii())+bytearray(b"\x00\x00"))
+        os.close(fd)
+        for workers in (1, 3):
+            parsed = BERTlvList.parse_parallel(path, workers = workers)
+            assert isinstance(parsed, T3List)
+            assert [Hex(tlv) for tlv in parsed] == tlvs
+            it = BERTlvList.parse_parallel(path, workers = workers, iterator = True)
+            assert [Hex(tlv) for tlv in it] == tlvs
+        assert parsed[149].find_tag("83").Value == 0x92
+        assert len(T3TlvList(BERTlv, BERTl, maximum = 7).parse_parallel(path, 2)) == 7
+        it = BERTlvList.parse_parallel(path, workers = 2, iterator = True)
+        assert Hex(next(it)) == tlvs[0]
+        it.close()
+        assert len(TlvList.parse_parallel(path, 2)) == len(TlvList << data // Hex("00 00"))
+    finally:
+        os.remove(path)
+
+def test_lazy():
+    data = Hex("7F 05 03 80 01 00 62 0B 82 01 10 A5 06 83 01 92 84 01 77")
+    tlvs = LazyBERTlvList << data
+    assert isinstance(tlvs[1]["Value"].value, T3LazyValue)
+    assert Hex(tlvs[1]) == data[6:]
+    assert isinstance(tlvs[1]["Value"].value, T3LazyValue)
+    tlv = tlvs[1].find_tag("83")
+    assert tlv.Value == 0x92
+    assert isinstance(tlvs[1]["Value"].value, T3List)
+    assert isinstance(tlvs[1].Value[1]["Value"].value, T3List)
+    assert isinstance(tlvs[0]["Value"].value, T3LazyValue)
+    assert [Hex(tlv) for tlv in tlvs] == [Hex(tlv) for tlv in BERTlvList << data]
+
+    tlvs = LazyBERTlvList << data
+    tlvs[1].Value[0].Value = "10 11"
+    assert Hex(tlvs[1].Value[0]) == Hex("82 02 10 11")
+
+    # a projection skips a constructed value by its length without matching it
+    for T in (BERTlv, LazyBERTlv):
+        tlv = T.match(data[6:], fields = ["Tag", "Len"]).value
+        assert isinstance(tlv["Value"].value, T3LazyValue)
+        assert Hex(tlv) == data[6:]
+        assert [Hex(v) for v in tlv.Value] == ["82 01 10", "A5 06 83 01 92 84 01 77"]
+
+def test_tag_index():
+    data = Hex("7F 05 03 80 01 00 62 0B 82 01 10 A5 06 83 01 92 84 01 77")
+    tlvs = T3TlvList(BERTlv, BERTl, index = True) << data
+    tlv = tlvs[1]
+    assert tlv._index is not None
+    assert tlv.find_tag("84") is tlv.Value[1].Value[1]
+    assert [Hex(t) for t in tlv.find_tags("83")] == ["83 01 92"]
+    assert tlv.find_tag("80") is None
+    # the index is rebuilt after an update
+    tlv.Value[1].Value[1].Tag = "80"
+    assert tlv._index is None
+    assert tlv.find_tag("80") is tlv.Value[1].Value[1]
+    assert tlv.find_tag("84") is None
+    tlv = (BERTlv << data[6:]).build_index()
+    assert tlv.find_tag("A5") is tlv.Value[1]
+
+def test_extract():
+    data = Hex("7F 05 03 80 01 00 62 0B 82 01 10 A5 06 83 01 92 84 01 77 83 01 93")
+    tlvs = BERTlvList << data
+    res = extract(tlvs, ["83", "84", "99", 0x80])
+    assert res == {"83": "92", "84": "77", 0x80: "00"}
+    res = extract(tlvs, ["83"], multiple = True)
+    assert res == {"83": ["92", "93"]}
+    assert extract(tlvs[1], ["A5"])["A5"] == tlvs[1].Value[1].Value
+    # a subtree which can't contain a searched tag is skipped without decoding it
+    tlvs = LazyBERTlvList << data
+    res = extract(tlvs, ["83"], multiple = True, template = {"7F05": ["80"], "62": ["82", "A5", "84"]})
+    assert res == {"83": ["93"]}
+    assert isinstance(tlvs[0]["Value"].value, T3LazyValue)
+    assert isinstance(tlvs[1]["Value"].value, T3LazyValue)
+
+def test_cached_len():
+    tlv = BERTlv(Tag = 0xA1, Value = BERTlv(Tag = 0xA2, Value = BERTlv(Tag = 0x80, Value = "01")))
+    assert Hex(tlv) == "A1 05 A2 03 80 01 01"
+    # the computed lengths are kept
+    assert tlv["Len"].value == 5
+    assert tlv.Value["Len"].value == 3
+    tlv.Value.Value.Value = "01 02"
+    assert Hex(tlv) == "A1 06 A2 04 80 02 01 02"
+    # changing a T3List updates the lengths as well
+    tlv = BERTlv << "62 06 82 01 10 83 01 92"
+    assert tlv.Len == 6
+    tlv.Value.append(BERTlv(Tag = 0x84, Value = "77"))
+    assert Hex(tlv) == "62 09 82 01 10 83 01 92 84 01 77"
+    tlv.Value[2].Value = "77 78"
+    assert tlv.Len == 10
+    del tlv.Value[:2]
+    assert Hex(tlv) == "62 04 84 02 77 78"
+
+def test_concurrent():
+    import threading
+    data = Hex("62 0B 82 01 10 A5 06 83 01 92 84 01 77")
+    errors = []
+    def run(k):
+        try:
+            for i in range(50):
+                n = i%3+1
+                tlv = BERTlv << data
+                tlv.Value[1].Value[0].Value = "%02X"%k*n
+                H = "62 %02X 82 01 10 A5 %02X 83 %02X %s 84 01 77"%(0x0A+n, 0x05+n, n, "%02X"%k*n)
+                assert Hex(tlv) == H
+        except Exception as e:
+            errors.append(e)
+    threads = [threading.Thread(target = run, args = (k,)) for k in range(1, 5)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert not errors, errors
+    # the same binding evaluated for nested tables isn't circular
+    tlv = BERTlv(Tag = 0x80, Value = "01")
+    for i in range(20):
+        tlv = BERTlv(Tag = 0xA1, Value = tlv)
+    assert len(Hex(tlv)) == 43
+
+def test_byte_length():
+    data = Hex("7F 05 03 80 01 00 62 0B 82 01 10 A5 06 83 01 92 84 01 77")
+    for tlvs in (BERTlvList << data, LazyBERTlvList << data):
+        assert [tlv.byte_length() for tlv in tlvs] == [6, 13]
+        assert tlvs.byte_length() == len(data)
+    tlv = tlvs[1]
+    # the cached lengths are updated with the tree
+    tlv.Value[1].Value[0].Value = "92 93 94"
+    assert tlv.byte_length() == len(Hex(tlv)) == 15
+    tlv.Value.pop()
+    assert tlv.byte_length() == len(Hex(tlv)) == 5
+    assert Hex(tlv) == "62 03 82 01 10"
+    big = BERTlv(Tag = 0xA1, Value = BERTlv(Tag = 0x80, Value = "00"*0x100))
+    assert big.byte_length() == len(Hex(big)) == 0x100 + 8
+
+def test_zero_bytes():
+    # zero bytes after a T3Bitmap are matched as Hex and serialized unchanged
+    tlv = BERTlv << "5A 00"
+    assert Hex(tlv) == "5A 00"
+    assert tlv.byte_length() == 2
+    tlvs = BERTlvList << "70 04 5A 00 80 00"
+    tlvs[0].Value.append(BERTlv(Tag = 0x80, Value = "01"))
+    assert Hex(tlvs) == "70 07 5A 00 80 00 80 01 01"
+
 
 if __name__ == '__main__':
     test_tag()
     test_length()
-    test_tlv_concatenation()
\ No newline at end of file
+    test_tlv_concatenation()
+    test_push_parser()
+    test_parse_parallel()
+    test_lazy()
+    test_tag_index()
+    test_extract()
+    test_cached_len()
+    test_concurrent()
+    test_byte_length()
+    test_zero_bytes()
\ No newline at end of file
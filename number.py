@@ -6,9 +6,10 @@
 #
 # ======================================================================
 
-__all__ = ["T3Number", "T3NumberFormatter", "Hex", "Bin", "Bcd", "NULL"]
+__all__ = ["T3Number", "T3NumberFormatter", "Hex", "HexView", "Bin", "Bcd", "NULL"]
 
 from array import array
+import binascii
 import functools
 import abc
 import sys
@@ -156,6 +157,18 @@ class T3Number(object):
             else:
                 raise TypeError("illegal argument type %s"%type(data))
 
+    @classmethod
+    def _fromdigits(cls, s, base):
+        '''
+        Creates a number from a numeral string s which is already normalized, i.e. it
+        was taken from the numeral string of another number of the same class and base.
+        '''
+        number = object.__new__(cls)
+        number.base = base
+        number._str = s
+        number._int = int(s, base)
+        return number
+
     def _preserve_leading_zeros(self, data, base):
         '''
         This function is used preserve leading zeros of a number represented in 
@@ -271,6 +284,12 @@ class T3Number(object):
     def __len__(self):
         return len(self._str)
 
+    def byte_length(self):
+        '''
+        :returns: the number of bytes of the number as a Hex.
+        '''
+        return len(Hex(self))
+
     def concat(self, other):
         return self.__floordiv__(other)
 
@@ -671,9 +690,16 @@ class _NullNumber(T3Number):
     def __repr__(self):
         return "NULL"
 
+    def __reduce__(self):
+        # NULL is a singleton which is compared by identity
+        return "NULL"
+
     def __len__(self):
         return 0
 
+    def byte_length(self):
+        return 0
+
     def __mul__(self, other):
         return self
 
@@ -767,6 +793,20 @@ class Hex(T3Number):
             else:
                 raise ValueError("Hex object was constructed with an odd number of digits: '%s'. An even number was expected"%data)
 
+    @classmethod
+    def frombytes(cls, data):
+        '''
+        Creates a Hex number from a bytes-like object e.g. a bytearray, a memoryview or
+        an mmap. Other than Hex(array) the conversion isn't done byte by byte in Python.
+        '''
+        s = binascii.hexlify(data).upper()
+        if not isinstance(s, str):
+            s = s.decode("ascii")
+        if s:
+            return cls._fromdigits(s, 16)
+        else:
+            return T3Number.NULL
+
     def _from_integer(self, n, base):
         super(Hex, self)._from_integer(n, base)
         if len(self._str) & 1 == 1:
@@ -796,6 +836,9 @@ class Hex(T3Number):
     def __len__(self):
         return len(self._str)//2
 
+    def byte_length(self):
+        return len(self)
+
     def __iter__(self):
         i = 0
         while i<len(self._str):
@@ -813,10 +856,119 @@ class Hex(T3Number):
         else:
             s = self._str[slice(i*2, i*2+2 if i!=-1 else None, 1)]
         if s:
-            return self.__class__(s, self.base)
+            return self._fromdigits(s, self.base)
         else:
             return T3Number.NULL
 
+############################  HexView  ###################################
+
+def _is_zero(buffer, start, stop, blocksize = 4096):
+    for i in range(start, stop, blocksize):
+        if bytearray(buffer[i:min(i+blocksize, stop)]).strip(b"\0"):
+            return False
+    return True
+
+class HexView(Hex):
+    '''
+    A HexView is a Hex number which refers to the bytes buffer[start:stop] of a bytes-like
+    object, e.g. an mmap. Its digits and integer value are computed when they are first
+    used. A slice of a HexView is again a HexView of the same buffer.
+
+    HexView(data) creates a Hex object like Hex(data). Use HexView.frombuffer to create a
+    view.
+    '''
+    # a view has no __dict__ unless a formatter is set, parsed tables hold many views
+    __slots__ = ("base", "_buffer", "_start", "_stop", "_s", "_i")
+
+    def __new__(cls, data, base = 16, leftpad = False):
+        return Hex(data, base, leftpad)
+
+    @classmethod
+    def frombuffer(cls, buffer, start = 0, stop = None):
+        n = len(buffer)
+        stop = n if stop is None else min(stop, n)
+        if start>=stop:
+            return T3Number.NULL
+        view = object.__new__(cls)
+        view.base    = 16
+        view._buffer = buffer
+        view._start  = start
+        view._stop   = stop
+        view._s = view._i = None
+        return view
+
+    @classmethod
+    def _fromdigits(cls, s, base):
+        return Hex._fromdigits(s, base)
+
+    @property
+    def _str(self):
+        if self._s is None:
+            s = binascii.hexlify(self._buffer[self._start:self._stop]).upper()
+            self._s = s if isinstance(s, str) else s.decode("ascii")
+        return self._s
+
+    @_str.setter
+    def _str(self, s):
+        # the digits were modified and the view is detached from its buffer
+        self._s = s
+        self._i = None
+        self._buffer = None
+
+    @property
+    def _int(self):
+        if self._i is None:
+            self._i = int(self._str, 16)
+        return self._i
+
+    @_int.setter
+    def _int(self, n):
+        self._i = n
+
+    def __len__(self):
+        if self._buffer is None:
+            return len(self._s)//2
+        return self._stop - self._start
+
+    def __getitem__(self, i):
+        if self._buffer is None:
+            return super(HexView, self).__getitem__(i)
+        n = len(self)
+        if isinstance(i, slice):
+            start, stop, step = i.indices(n)
+            if step != 1:
+                return super(HexView, self).__getitem__(i)
+            return HexView.frombuffer(self._buffer, self._start+start, self._start+stop)
+        if i<0:
+            i+=n
+        if not 0<=i<n:
+            raise IndexError("index out of range")
+        return HexView.frombuffer(self._buffer, self._start+i, self._start+i+1)
+
+    def __eq__(self, other):
+        if isinstance(other, HexView) and self._buffer is not None and \
+           other._buffer is self._buffer and other._stop == self._stop:
+            # one view is a suffix of the other, so they are equal if the
+            # bytes in front of the shorter view are zero
+            start, stop = sorted((self._start, other._start))
+            return _is_zero(self._buffer, start, stop)
+        return super(HexView, self).__eq__(other)
+
+    def __ne__(self, other):
+        return not self.__eq__(other)
+
+    __hash__ = Hex.__hash__
+
+    def __nonzero__(self):
+        if self._buffer is None:
+            return self._int != 0
+        return not _is_zero(self._buffer, self._start, self._stop)
+
+    __bool__ = __nonzero__
+
+    def __reduce__(self):
+        return (Hex, (self._str,))
+
 ############################  Binary Coded Digits (Bcd) ###################################
 
 class Bcd(T3Number):
@@ -1033,6 +1185,9 @@ def test_length():
         pass
     else:
         assert False, "ValueError not raised"
+    assert Hex("00 01 02").byte_length() == 3
+    assert Bin("0000000000000001").byte_length() == 2
+    assert T3Number.NULL.byte_length() == 0
 
 def test_join():
     assert Hex.join(['72', 0x6627, T3Number(67, 10)]) == '72 66 27 43'
@@ -1055,6 +1210,30 @@ def test_subscript():
     else:
         assert False, "IndexError not raised"
 
+def test_frombytes():
+    assert Hex.frombytes(bytearray([0x80, 0x01, 0xaf])) == Hex("80 01 AF")
+    assert Hex.frombytes(bytearray([0, 0, 1])).digits() == "000001"
+    assert Hex.frombytes(bytearray()) is NULL
+    assert Hex.frombytes(bytearray([0, 0, 1]))[1:].digits() == "0001"
+
+def test_hexview():
+    buf = bytearray([0x00, 0x80, 0x01, 0xaf, 0x00])
+    h = HexView.frombuffer(buf)
+    assert len(h) == 5 and h._s is None
+    v = h[1:4]
+    assert isinstance(v, HexView) and len(v) == 3
+    assert v == Hex("80 01 AF") and v[1] == 1 and v[-1] == 0xAF
+    assert h[1:] == Hex("80 01 AF 00")
+    assert h[1:] != h[2:] and h[1:] == h
+    assert h._s is None
+    assert HexView("80 01") == Hex("80 01") and type(HexView("80 01")) is Hex
+    assert h[3:3] is NULL
+    assert Hex(v) // Hex("02") == Hex("80 01 AF 02")
+    v.zfill(8)
+    assert v.digits() == "0080" "01AF" and len(v) == 4
+    import pickle
+    assert pickle.loads(pickle.dumps(h[1:3])) == Hex("80 01")
+
 def test_character_conversion():
     assert Hex("88 {\t}") == "88 09"
     assert Hex("{C1i%$} 88 { }{} AF {+?} ") == "43 31 69 25 24 88 20 AF 2B 3F"    
@@ -1094,6 +1273,8 @@ if __name__ == '__main__':
     test_simple_formatting()
     test_iter()
     test_subscript()
+    test_frombytes()
+    test_hexview()
     test_character_conversion()
 
 
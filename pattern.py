@@ -51,6 +51,10 @@ def pattern_factory(arg):
         return T3PatternValue(arg)
 
 class T3Match(object):
+    # A failing match sets ``need`` to the number of missing items, usually bytes, when it
+    # failed because data ended early. More data can't make a match with need = 0 succeed.
+    need = 0
+
     def __init__(self, value, rest, fail = False):
         self.value = value
         self.rest  = rest
@@ -84,14 +88,17 @@ class T3PatternTable(T3Pattern):
                                            ...
                                            )
     '''
-    def __init__(self, fields):
+    def __init__(self, fields, start = 0):
+        # the fields are matched from position start on. The pattern of the remaining
+        # fields shares the list of fields instead of slicing it.
         self.fields = fields
+        self.start  = start
 
     def match(self, data):
-        field = self.fields[0]
+        field = self.fields[self.start]
         P = field.pattern
-        if len(self.fields)>1:
-            Q = T3PatternTable(self.fields[1:])
+        if len(self.fields)-self.start>1:
+            Q = T3PatternTable(self.fields, self.start+1)
             if isinstance(P, T3PatternAny):
                 for k in range(len(data)-1, -1, -1):
                     m = Q.match(data[k:])
@@ -153,7 +160,9 @@ class T3PatternSection(T3Pattern):
         if len(value) == self.count:
             return T3Match(value, data[self.count:])
         else:
-            return T3Match(None, data, fail = True)
+            m = T3Match(None, data, fail = True)
+            m.need = self.count - len(value)
+            return m
 
 class T3PatternAny(T3Pattern):
     '''
@@ -170,11 +179,16 @@ class T3PatternAlt(T3Pattern):
         self.patterns = patterns
 
     def match(self, data):
+        need = 0
         for pattern in self.patterns:
             m = pattern.match(data)
             if not m.fail:
                 return m
-        return T3Match(None, data, fail = True)
+            if m.need and (not need or m.need<need):
+                need = m.need
+        m = T3Match(None, data, fail = True)
+        m.need = need
+        return m
 
 class T3PatternValue(T3Pattern):
     '''
@@ -194,7 +208,11 @@ class T3PatternValue(T3Pattern):
             value = self.value
         k = len(value)
         if data[:k] != value:
-            return T3Match(None, data, fail = True)
+            m = T3Match(None, data, fail = True)
+            n = len(data)
+            if n<k and hasattr(value, "digits") and (n == 0 or value.digits().startswith(data.digits())):
+                m.need = k - n
+            return m
         return T3Match(data[:k], data[k:])
 
 class T3PatternPrefixed(T3Pattern):
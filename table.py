@@ -10,26 +10,35 @@
 
 __all__ = [
     "T3Binding",
+    "T3LazyValue",
     "T3Field",
     "T3Table",
     "T3TableContext",
     "T3List",
     "T3Set",
+    "T3Packrat",
     "T3Bitset",
     "T3Repeater",
+    "T3PushParser",
     "T3Bitmap"]
 
 import sys
 import abc
+import binascii
 import functools
+import mmap
+import os
 import pprint
-from collections import Iterable, defaultdict
+import threading
+import traceback
+import weakref
+from collections import Iterable, OrderedDict
 from copy import copy
 
 import t3
 import t3.pattern
 from t3.pattern import T3Pattern, T3Match, MatchingFailure
-from t3.number import T3Number, Hex, Bin, T3Value
+from t3.number import T3Number, Hex, HexView, Bin, T3Value
 
 
 MAXSIZE = 2**64
@@ -37,23 +46,28 @@ MAXSIZE = 2**64
 ###################################### T3Binding #################################
 
 class T3Binding(object):    
+    '''
+    Computes a field value by ``callback`` from the field ``name`` of a table, from
+    the fields behind the bound field if name is "*" or from the table if name is None.
+    A T3Binding is part of a schema and shared by the copies of a table. The table is
+    passed to each evaluation, so one binding can be evaluated by several threads.
+    '''
     def __init__(self, callback, name = None):
-        self.obj = None
         self.name = name
         self.callback = callback
 
-    def get_value(self):
-        return self.callback(self._bound_value())
+    def get_value(self, obj):
+        return self.callback(self._bound_value(obj))
 
-    def _compute_rest(self):
+    def _compute_rest(self, obj):
         "Function used to handle the '*' binding pattern"
-        if not isinstance(self.obj, Iterable):
-            raise TypeError("binding object '%s'is not iterable"%self.obj)
-        if isinstance(self.obj, T3Table):
+        if not isinstance(obj, Iterable):
+            raise TypeError("binding object '%s'is not iterable"%obj)
+        if isinstance(obj, T3Table):
             value = []
-            for i, field in enumerate(self.obj):
+            for i, field in enumerate(obj):
                 if field.value_binding == self:
-                    value = [field.get_value() for field in self.obj._fields[i+1:]]
+                    value = [field.get_value() for field in obj._fields[i+1:]]
                     break
             if value:
                 return functools.reduce(lambda x,y: x // y, value)
@@ -62,13 +76,90 @@ class T3Binding(object):
         else:
             raise TypeError("unable to compute rest of the object")
 
-    def _bound_value(self):
+    def _bound_value(self, obj):
         if self.name == "*":
-            return self._compute_rest()
+            return self._compute_rest(obj)
         elif self.name:
-            return getattr(self.obj, self.name)
+            return getattr(obj, self.name)
         else:
-            return self.obj
+            return obj
+
+# (binding, table) pairs which are evaluated by the current thread
+_evaluating = threading.local()
+
+def _evaluate(binding, table):
+    # evaluates binding for table. A binding which is evaluated again for the same table
+    # while its evaluation is in progress is circular.
+    active = getattr(_evaluating, "active", None)
+    if active is None:
+        active = _evaluating.active = set()
+    key = (id(binding), id(table))
+    if key in active:
+        raise RuntimeError("Circular binding can't be resolved")
+    active.add(key)
+    try:
+        return binding.get_value(table)
+    finally:
+        active.discard(key)
+
+def _binding_reads(fields, i):
+    # names of the fields the binding of fields[i] reads
+    name = fields[i].value_binding.name
+    if name == "*":
+        return set(field.name for field in fields[i+1:])
+    elif name:
+        return set([name])
+    else:
+        return set(field.name for field in fields)
+
+def _byte_length(value):
+    # number of bytes which value contributes to the value of a table
+    if value is None:
+        return 0
+    if isinstance(value, T3LazyValue):
+        return len(value)
+    try:
+        return value.byte_length()
+    except AttributeError:
+        return len(Hex(value))
+
+def _concat(values):
+    # concatenation of the field values of a table. Hex values are joined in one pass
+    # instead of pairwise with // which copies the digits of all previous values
+    values = [v for v in values if v is not T3Number.NULL]
+    if not values:
+        return T3Number.NULL
+    if all(isinstance(v, Hex) for v in values):
+        return Hex._fromdigits("".join(v._str for v in values), 16)
+    return functools.reduce(lambda x,y: x // y, values)
+
+def _binding_order(fields):
+    # positions of the bound fields in an order in which each binding is evaluated after
+    # the bound fields it reads or None if the bindings are circular
+    bound = [i for (i, field) in enumerate(fields) if field.value_binding]
+    deps  = {}
+    for i in bound:
+        names = _binding_reads(fields, i)
+        if fields[i].value_binding.name is None:
+            names.discard(fields[i].name)
+        deps[i] = set(j for j in bound if fields[j].name in names)
+    order = []
+    while deps:
+        ready = sorted(i for i in deps if not deps[i])
+        if not ready:
+            return None
+        for i in ready:
+            del deps[i]
+            order.append(i)
+        for i in deps:
+            deps[i].difference_update(ready)
+    return tuple(order)
+
+def _checked_binding_order(fields):
+    order = _binding_order(fields)
+    if order is None:
+        raise RuntimeError("Circular binding can't be resolved")
+    return order
 
 #################################  _T3DocObject ###################################
 
@@ -80,9 +171,69 @@ class _T3DocObject:
     def __repr__(self):
         return self.callback(self.table)
 
+#################################  T3LazyValue ###################################
+
+class T3LazyValue(object):
+    '''
+    Placeholder for a field value which is matched by ``pattern`` when the field value
+    is first accessed. Until then only the matched ``data`` is kept and used when the
+    table is serialized.
+    '''
+    def __init__(self, pattern, data):
+        self.pattern = pattern
+        self.data    = data
+
+    def decode(self):
+        m = self.pattern.match(self.data)
+        if m.fail:
+            raise MatchingFailure(m)
+        if isinstance(m.value, T3LazyValue):
+            # the pattern defers the decoding itself
+            return m.value.decode()
+        return m.value
+
+    def get_value(self):
+        return self.data
+
+    def __len__(self):
+        return len(self.data)
+
+    def __repr__(self):
+        return "<T3LazyValue %s>"%self.data
+
 ######################################  T3Field ###################################
 
-_binding_stack = []
+class _T3FieldSchema(object):
+    '''
+    The part of a T3Field which is shared by all copies of a table: pattern, name,
+    value binding and value formatter. It is never changed. Setting one of these
+    attributes on a T3Field replaces the schema of this field.
+    '''
+    __slots__ = ("pattern", "name", "value_binding", "value_formatter")
+
+    def __init__(self, pattern, name, value_binding, value_formatter):
+        self.pattern = pattern
+        self.name    = name
+        self.value_binding   = value_binding
+        self.value_formatter = value_formatter
+
+    def __getstate__(self):
+        return (self.pattern, self.name, self.value_binding, self.value_formatter)
+
+    def __setstate__(self, state):
+        self.pattern, self.name, self.value_binding, self.value_formatter = state
+
+def _schema_attribute(name):
+    def get(field):
+        return getattr(field.schema, name)
+
+    def set(field, value):
+        schema = field.schema
+        if getattr(schema, name) is not value:
+            schema = _T3FieldSchema(*schema.__getstate__())
+            setattr(schema, name, value)
+            field.schema = schema
+    return property(get, set)
 
 class T3Field(object):
     '''
@@ -90,33 +241,62 @@ class T3Field(object):
     .--------------------------------------------------------.
     | Pattern | Name | ValueBinding | Value | ValueFormatter |
     '--------------------------------------------------------'
+
+    Pattern, Name, ValueBinding and ValueFormatter are kept in a schema which is
+    shared by the copies of the field. A copy stores only its value and its table.
+
+    A T3Table or T3List value is ``shared`` when it still belongs to the table this
+    field's table was copied from or to a copy of it. It is copied when the value is
+    accessed or before it is changed.
     '''
+    __slots__ = ("schema", "value", "table", "shared", "__weakref__")
+
     def __init__(self, pattern = None,
                        name    = None,
                        value   = T3Number.NULL,
                        value_binding   = None,
                        value_formatter = None,
                        table = None):
-        self.table   = table
-        self.name    = name
-        self.value   = value
-        self.pattern = self.make_pattern(pattern)
-        self.value_binding   = value_binding
-        self.value_formatter = value_formatter
+        self.table  = table
+        self.value  = value
+        self.shared = False
+        self.schema = _T3FieldSchema(self.make_pattern(pattern), name, value_binding, value_formatter)
+
+    pattern = _schema_attribute("pattern")
+    name    = _schema_attribute("name")
+    value_binding   = _schema_attribute("value_binding")
+    value_formatter = _schema_attribute("value_formatter")
 
     def make_pattern(self, P):
         if P is not None:
             return t3.pattern.pattern_factory(P)
 
     def __copy__(self):
-        # TODO: what about T3Lists? 
-        if isinstance(self.pattern, (T3Table, t3.pattern.T3PatternPrefixed)):
-            pattern = copy(self.pattern)
-        else:
-            pattern = self.pattern
-        field = T3Field(pattern, self.name, self.value, self.value_binding, self.value_formatter)
+        field = T3Field.__new__(T3Field)
+        field.schema = self.schema
+        field.value  = self.value
+        field.table  = None
+        field.shared = False
         return field
 
+    def __getstate__(self):
+        return (self.schema, self.value, self.table)
+
+    def __setstate__(self, state):
+        self.schema, self.value, self.table = state
+        self.shared = False
+
+    def _unshare(self):
+        # copies a shared value. Its own T3Table and T3List values stay shared.
+        self.shared = False
+        if isinstance(self.value, T3Table):
+            self.value = self.value._sharedcopy()
+            self.value._parent = self.table
+        else:
+            self.value = T3List(item._sharedcopy() if isinstance(item, T3Table) else item
+                                for item in self.value)
+            self.value._set_parent(self.table)
+
     def __bool__(self):
         return self.value is not None
 
@@ -128,23 +308,27 @@ class T3Field(object):
             self.value = T3Number.NULL
 
     def get_value(self):
-        global _binding_stack
+        if self.shared:
+            self._unshare()
         if self.value is not None and self.value is not T3Number.NULL:
+            if isinstance(self.value, T3LazyValue):
+                self.value = self.value.decode()
+                if self.table is not None:
+                    if isinstance(self.value, T3Table):
+                        self.value._parent = self.table
+                    elif isinstance(self.value, T3List):
+                        self.value._set_parent(self.table)
             return self.value
         if self.value_binding:
-            self.value_binding.obj = self.table
-            if len(_binding_stack)>10 and self.value_binding in _binding_stack:
-                _binding_stack = []
-                raise RuntimeError("Circular binding can't be resolved")
-            _binding_stack.append(self.value_binding)
-            value = self.value_binding.get_value()
-            _binding_stack.pop()
+            value = _evaluate(self.value_binding, self.table)
             if isinstance(value, T3Table):
                 return value
             if self.table:
-                return self.table._coerce(value)
-            else:
-                return value
+                value = self.table._coerce(value)
+            if self.value is T3Number.NULL:
+                # kept until T3Table._invalidate drops it
+                self.value = value
+            return value
         return self.value
 
     # The following three methods are defined for convenience. They are used when either a T3Field or a list [T3Field] of
@@ -163,18 +347,53 @@ class T3Field(object):
         return 1
 
     def __iter__(self):
-        return (self,)
+        return iter((self,))
 
     def __repr__(self):
         return "<t3table.T3Field '%s = %s'>"%(self.name, self.get_value())
 
 
+# guards the sets of fields which share a value, copies are made by several threads
+_sharing = threading.Lock()
+
+def _share(field):
+    # marks the T3Table or T3List value of field as shared. The value keeps a weak set
+    # of the fields which share it.
+    field.shared = True
+    value = field.value
+    with _sharing:
+        if value._sharers is None:
+            value._sharers = weakref.WeakSet()
+        value._sharers.add(field)
+
+def _unshare_copies(value):
+    # the fields which share value take their own copies before value is changed
+    if not value._sharers:
+        return
+    with _sharing:
+        fields = list(value._sharers)
+        value._sharers.clear()
+    for field in fields:
+        if field.shared and field.value is value:
+            field._unshare()
+
 ######################################  T3Table ###################################
 
 class T3Table(object):
+    # fields of a table are held in _fields. Other attributes, e.g. a __doc__ of the
+    # table or attributes of subclasses, are kept in the __dict__.
+    __slots__ = ("_fields", "_fieldindex", "_bindings", "_parent", "_size", "_span", "_matched", "__dict__")
+
+    _batch   = None   # _T3BatchLog of an active batch
+    _sharers = None   # fields of copies which share this table
+
     def __init__(self):
         self._fields     = []
-        self._fieldnames = defaultdict(int)
+        self._fieldindex = {}     # name -> positions of fields, shared by copies
+        self._bindings   = ()     # positions of bound fields in evaluation order
+        self._size       = None   # cached byte_length()
+        self._span       = None   # value of an unchanged table or its offsets in the parent
+        self._matched    = None   # positions of bound fields with matched values
         self._parent     = None
 
     @classmethod
@@ -199,41 +418,150 @@ class T3Table(object):
                 return field.get_value()
         for field in self._fields:
             if isinstance(field.value, T3Table):
-                res = field.value.find(name)
+                res = field.get_value().find(name)
                 if res:
                     return res
 
     def get_value(self):
-        value = []
+        span = self._get_span()
+        if span is not None:
+            # the table wasn't changed since it was matched or serialized
+            return span[:]
+        value = self._serialize()
+        if isinstance(value, Hex) and len(value):
+            # kept like matched data, so an update re-encodes only the updated table
+            # and its parents. The nested tables keep their offsets in this value.
+            self._span = _as_view(value)
+            return self._span[:]
+        return value
+
+    def _get_span(self):
+        # the kept value of the table: matched data, the value of a serialized table or
+        # the part of the kept value of the parent given by offsets (parent, start, stop)
+        span = self._span
+        if type(span) is tuple:
+            parent, start, stop = span
+            if parent is not self._parent:
+                return None
+            span = parent._get_span()
+            if span is not None:
+                return span[start:stop]
+        return span
+
+    def _nested_tables(self):
+        # the tables which are field values or items of a T3List field value
+        for field in self._fields:
+            v = field.value
+            if isinstance(v, T3Table):
+                yield v
+            elif isinstance(v, T3List):
+                for item in v:
+                    if isinstance(item, T3Table):
+                        yield item
+
+    def _serialize(self):
+        # value of the table. The nested tables which are serialized with it keep their
+        # offsets in the value instead of a copy of their value.
+        span = self._get_span()
+        if span is not None:
+            return span[:]
+        self._eval_bindings()
+        value  = []
+        tables = []
         for field in self._fields:
             if field:
-                v = field.get_value()
+                if isinstance(field.value, T3LazyValue):
+                    # serialization doesn't need to decode the value
+                    value.append(field.value.get_value())
+                    tables.append(None)
+                    continue
+                # nor to copy a shared value
+                v = field.value if field.shared else field.get_value()
                 if v is not None:
                     if isinstance(v, T3Bitmap):
                         value.append(Hex(v))
+                    elif isinstance(v, T3Table) and not field.shared:
+                        value.append(v._serialize())
+                        tables.append(v)
+                        continue
+                    elif isinstance(v, T3List) and not field.shared:
+                        for item in v:
+                            if isinstance(item, T3Table) and not isinstance(item, T3Bitmap):
+                                value.append(item._serialize())
+                                tables.append(item)
+                            else:
+                                item = item.get_value() if isinstance(item, T3Value) else item
+                                value.append(item if isinstance(item, Hex) else Hex(item))
+                                tables.append(None)
+                        continue
                     elif isinstance(v, T3Value):
                         value.append(v.get_value())
                     else:
                         value.append(v)
+                    tables.append(None)
+        if all(isinstance(v, Hex) for v in value):
+            start = 0
+            for v, table in zip(value, tables):
+                stop = start+len(v)
+                if table is not None:
+                    table._span = (self, start, stop) if stop>start else None
+                start = stop
         n = len(value)
         if n == 0:
             return self._get_null_value()
         elif n == 1:
             return value[0]
-        else:
-            return functools.reduce(lambda x,y: x // y, value)
+        return _concat(value)
+
+    def byte_length(self):
+        '''
+        :returns: the number of bytes of the table value. It is computed from the byte
+                  lengths of the field values without serializing them and kept until
+                  the table or one of its nested tables is updated.
+        '''
+        size = self._size
+        if size is None and self._span is not None:
+            span = self._span
+            size = span[2]-span[1] if type(span) is tuple else len(span)
+        if size is None:
+            self._eval_bindings()
+            size = 0
+            for field in self._fields:
+                if field:
+                    if field.shared or isinstance(field.value, T3LazyValue):
+                        size+=_byte_length(field.value)
+                    else:
+                        size+=_byte_length(field.get_value())
+            self._size = size
+        return size
 
     def add(self, pattern = 0, **kwds):
+        self._copy_on_write()
         field = self._new_field(pattern, kwds)
+        if field.value_binding:
+            self._bindings = _checked_binding_order(self._fields+[field])
         self._fields.append(field)
-        self._fieldnames[field.name]+=1
+        self._index_field(field)
+        self._size = self._span = None
         if isinstance(field.value, T3Table):
             field.value._parent = self
+        elif isinstance(field.value, T3List):
+            field.value._set_parent(self)
         field.table = self
         return self
 
-    def match(self, data):
-        data   = self._coerce(data)
+    def match(self, data, fields = None):
+        '''
+        :param data: data to be matched.
+        :param fields: optional list of the names of the fields which shall be built.
+                       A name can be a path like "Hdr.Seq" into a nested table. The
+                       other fields are skipped by their size if possible and get values
+                       which are matched when they are first accessed.
+        :returns: T3Match
+        '''
+        data   = _as_view(self._coerce(data))
+        if fields is not None:
+            return self._match_projection(data, _projection(fields))
         table  = copy(self)
         fields = [field for field in table._fields if field]
         P = t3.pattern.T3PatternTable(fields)
@@ -245,8 +573,105 @@ class T3Table(object):
             else:
                 m.value = table
                 table._auto_parent()
+                table._set_matched()
+                table._set_span(data, m.rest)
         return m
 
+    def push_parser(self):
+        '''
+        :returns: T3PushParser which parses a stream of tables fed in chunks.
+        '''
+        return T3PushParser(self)
+
+    def read_from(self, fileobj):
+        '''
+        Reads one table from a binary file object. Only the bytes of the table are read,
+        the size callbacks of the table decide how many bytes are read next.
+
+        :param fileobj: object with a ``read(n)`` method, e.g. a file or a socket file.
+        :returns: the table or None if fileobj was at the end of the file.
+        :raises MatchingFailure: if the bytes read don't form a table.
+        '''
+        return next(_read_tables(T3PushParser(self, maximum = 1), fileobj), None)
+
+    def parse_file(self, path):
+        '''
+        Matches the content of a file. The file is memory mapped and the values of the
+        fields are HexView objects which refer to the map as long as they aren't modified.
+
+        :param path: path of a binary file.
+        :returns: the matched table.
+        :raises MatchingFailure: if the content doesn't match.
+        '''
+        return self << _map_file(path)
+
+    def _match_projection(self, data, projection):
+        if any(isinstance(field.pattern, t3.pattern.T3PatternAny) for field in self._fields[:-1] if field):
+            # backtracking isn't supported by projections
+            return self.match(data)
+        table = self.__class__()
+        table._fieldindex = self._fieldindex
+        table._bindings   = self._bindings
+        for field in self._fields:
+            F = copy(field)
+            F.table = table
+            table._fields.append(F)
+        R = data
+        for field in table._fields:
+            if not field:
+                continue
+            P = field.pattern
+            if isinstance(P, t3.pattern.T3PatternFunction):
+                P = t3.pattern.pattern_factory(P.getpattern(table, R))
+            m = _match_projected(P, R, projection.get(field.name, _SKIP))
+            if m.fail:
+                return m
+            field.value = m.value
+            R = m.rest
+        if R == data:
+            return T3Match(None, data, fail = True)
+        table._auto_parent()
+        table._set_matched()
+        table._set_span(data, R)
+        return T3Match(table, R)
+
+    def finditer(self, buffer, overlapped = False):
+        '''
+        Scans ``buffer`` for occurrences of this table.
+
+        :param buffer: T3Number or bytes-like object, e.g. a bytearray or an mmap.
+        :param overlapped: if False scanning continues behind a matched table, otherwise
+                           at the next byte.
+        :returns: iterator of pairs (offset, table) where offset is the byte offset of
+                  the matched table in ``buffer``.
+
+        When the table starts with literal bytes, possibly behind fixed size sections,
+        the buffer is searched for the literals and the table is matched only there.
+        '''
+        return _finditer(self, self._coerce, buffer, overlapped)
+
+    def compile(self, debug = False):
+        '''
+        Generates a specialized match function for this table.
+
+        :param debug: if True the generated source code is written to stdout.
+        :returns: function f which can be used in place of ``self.match``. The generated
+                  source code is available as ``f.source``.
+        '''
+        from t3.codegen import compile_matcher
+        return compile_matcher(self, debug)
+
+    def compile_unparser(self, debug = False):
+        '''
+        Generates an unparse plan for this table used as a prototype.
+
+        :param debug: if True the generated source code is written to stdout.
+        :returns: function f with f(**fields) == Hex(self(**fields)). The generated source
+                  code is available as ``f.source``.
+        '''
+        from t3.codegen import compile_unparser
+        return compile_unparser(self, debug)
+
     def __iter__(self):
         return self._fields.__iter__()
 
@@ -261,15 +686,13 @@ class T3Table(object):
             return m.value
 
     def __getitem__(self, name):
-        k = self._fieldnames.get(name, 0)
-        if k == 0:
+        positions = self._fieldindex.get(name)
+        if positions is None:
             raise AttributeError("Field with name '%s' not found"%name)
-        elif k == 1:
-            for field in self._fields:
-                if field.name == name:
-                    return field
+        elif len(positions) == 1:
+            return self._fields[positions[0]]
         else:
-            return list(field for field in self._fields if field.name == name)
+            return [self._fields[k] for k in positions]
 
     def __len__(self):
         return len(self._fields)
@@ -278,22 +701,45 @@ class T3Table(object):
         return bool(len(self._fields))
 
     def __contains__(self, name):
-        return name in self._fieldnames
+        return name in self._fieldindex
 
-    def __copy__(self):
-        table = self.__class__()
+    def __getstate__(self):
         for field in self._fields:
-            R = copy(field)
-            R.table = table
-            table._fields.append(R)
-        table._fieldnames = self._fieldnames.copy()
+            if field.shared:
+                field._unshare()
+        dct = dict(self.__dict__)
+        dct.pop("_sharers", None)
+        return (self._fields, self._fieldindex, self._bindings, self._parent, dct)
+
+    def __setstate__(self, state):
+        self._fields, self._fieldindex, self._bindings, self._parent, dct = state
+        self._size = None
+        self._span = None
+        self._matched = None
+        self.__dict__.update(dct)
+
+    def _index_field(self, field):
+        # registers the position of the last added field. The index is replaced and not
+        # modified, because it is shared with the copies of the table.
+        index = dict(self._fieldindex)
+        index[field.name] = self._fieldindex.get(field.name, ()) + (len(self._fields)-1,)
+        self._fieldindex = index
+
+    def __copy__(self):
+        # the copied fields share their schema with the fields of this table. Only
+        # values are written by a match or an update.
+        table  = self.__class__()
+        fields = [field.__copy__() for field in self._fields]
+        for field in fields:
+            field.table = table
+        table._fields     = fields
+        table._fieldindex = self._fieldindex
+        table._bindings   = self._bindings
+        table._matched    = self._matched
         return table
 
     def __call__(self, __doc__ = "", **fields):
-        R = self._get_root()
-        memo  = {}
-        root  = R._treecopy(memo)
-        table = memo[id(self)]
+        table, root = self._pathcopy()
         if __doc__:
             if hasattr(__doc__, "__call__"):
                 table.__doc__ = _T3DocObject(table, __doc__)
@@ -306,13 +752,16 @@ class T3Table(object):
             except AttributeError:
                 pass
         for name, value in fields.items():
-            if name in table._fieldnames:
+            if name in table._fieldindex:
                 table.__setattr__(name, value)
             else:
                 raise ValueError("cannot create copy of T3Table with new field '%s'"%name)
         return root
 
     def __getattr__(self, name):
+        if name.startswith("_"):
+            # not a field, e.g. a lookup of __getstate__ or of _fields during unpickling
+            raise AttributeError(name)
         field = self.__getitem__(name)
         if len(field) == 1:
             return field.get_value()
@@ -343,19 +792,22 @@ class T3Table(object):
         if isinstance(v, T3Binding):
             field.value_binding = v
         elif v is None or isinstance(v, (T3List, T3Table)):
-            field.value = v
+            field.value  = v
+            field.shared = False
         elif isinstance(v, T3Field):
             if field.name != v.name:
                 raise ValueError("Cannot update field '%s' with field '%s'. Fields must have equal names"%(field.name, v.name))
             self._set_pattern(field, v.pattern)
             if v.value_binding:
-                field.value = self._get_null_value()
+                field.value  = self._get_null_value()
+                field.shared = False
                 field.value_binding = v.value_binding
             else:
                 field.value_binding = None
                 self._set_value_and_binding(field, v.value)
         else:
-            field.value = self._coerce(v)
+            field.value  = self._coerce(v)
+            field.shared = False
         return field
 
     def _set_pattern(self, field, P):
@@ -382,25 +834,158 @@ class T3Table(object):
                 raise TypeError("can't add field which has a T3Table attribute name: '%s'"%field.name)
         return field
 
-    def _clear(self):
-        # NULLs values of T3Fields with ValueBindings. This causes a re-computation
-        # of values when the T3Table is updated.
-        for field in self._fields:
-            if field.value_binding:
-                if field.value is not None:
+    def _eval_bindings(self):
+        # evaluates the bindings of fields with NULL values in the order of _bindings.
+        # A binding reads only fields which are evaluated already, so no check for
+        # circular bindings is needed.
+        fields = self._fields
+        for i in self._bindings:
+            field = fields[i]
+            if field.value is T3Number.NULL:
+                value = field.value_binding.get_value(self)
+                if not isinstance(value, T3Table):
+                    field.value = self._coerce(value)
+
+    def _invalidate(self, names):
+        # NULLs the values of the bound T3Fields which read one of the fields ``names``
+        # directly or through other bound fields. This causes a re-computation of these
+        # values. When a field of this table changed the field of the parent which holds
+        # this table changed as well. Matched values of bound fields of this table are
+        # dropped once, because they might be inconsistent with the other fields.
+        # Computed values are kept unless they read a changed field.
+        if self._matched:
+            fields = self._fields
+            for i in self._matched:
+                field = fields[i]
+                if field.name not in names and field.value is not None:
                     field.value = self._get_null_value()
-            elif isinstance(field.value, T3Table):
-                field.value._clear()
+            self._matched = None
+        table = self
+        while True:
+            fields  = table._fields
+            reads   = [(field, _binding_reads(fields, i)) for (i, field) in enumerate(fields)
+                       if field.value_binding]
+            changed = set(names)
+            names   = list(names)
+            while names and reads:
+                n = names.pop()
+                for field, names_read in reads:
+                    if field.name not in changed and n in names_read:
+                        if field.value is not None:
+                            field.value = table._get_null_value()
+                        changed.add(field.name)
+                        names.append(field.name)
+            parent = table._parent
+            if parent is None:
+                return
+            holder = parent._holder(table)
+            if holder is None:
+                return
+            table, names = parent, [holder.name]
+
+    def _holder(self, table):
+        # the field whose value is ``table`` or a T3List which contains ``table``
+        for field in self._fields:
+            if field.value is table:
+                return field
+            if isinstance(field.value, T3List):
+                for item in field.value:
+                    if item is table:
+                        return field
+
+    def _changed(self):
+        # called for the updated table and each of its parents. The nested tables which
+        # keep offsets in the value of this table keep the part of the value instead.
+        value = self._get_span()
+        if value is not None:
+            for table in self._nested_tables():
+                span = table._span
+                if type(span) is tuple and span[0] is self:
+                    table._span = value[span[1]:span[2]]
+        self._size = None
+        self._span = None
+
+    def _set_span(self, data, rest):
+        # keeps the matched bytes which are the value of the table until it is updated.
+        # data is a view, so the span refers to the buffer of the matched data. Nothing
+        # is kept when the rest isn't a Hex, e.g. when bits were matched.
+        if not isinstance(data, Hex):
+            return
+        if rest is None or rest is T3Number.NULL:
+            stop = len(data)
+        elif isinstance(rest, Hex):
+            stop = len(data)-len(rest)
+        else:
+            return
+        if stop>0:
+            self._span = data[:stop]
+
+    def _sharedcopy(self):
+        # copy of this table which shares the T3Table and T3List values with this table
+        table = self.__copy__()
+        table._span = self._get_span()
+        if self.__doc__ is not type(self).__doc__:
+            table.__doc__ = self.__doc__
+        # the copy copies a shared value before it is accessed. This table keeps its
+        # values, the copy copies them before they are changed.
+        for field in table._fields:
+            if isinstance(field.value, (T3Table, T3List)):
+                _share(field)
+        return table
+
+    def _copy_on_write(self):
+        # called before this table is changed. The copies which share this table, one
+        # of its parents or a T3List value of them take their own copies. Copying starts
+        # at the root, so the copies made there which share the next table on the path
+        # take their own copies as well.
+        path  = []
+        table = self
+        while table is not None:
+            path.append(table)
+            table = table._parent
+        for table in reversed(path):
+            _unshare_copies(table)
+            for field in table._fields:
+                if isinstance(field.value, T3List):
+                    _unshare_copies(field.value)
+
+    def _pathcopy(self):
+        # copies the tables on the path from the root to this table. The other
+        # values are shared. Returns the copy of this table and the copy of the root.
+        if self._parent is None:
+            table = self._sharedcopy()
+            return table, table
+        parent, root = self._parent._pathcopy()
+        field = parent._holder(self)
+        if field is None:
+            raise ValueError("table not found in its parent")
+        if field.value is self:
+            field._unshare()
+            return field.value, root
+        k = [item is self for item in field.value].index(True)
+        field._unshare()
+        return field.value[k], root
 
     def _treecopy(self, memo):
         table = self.__copy__()
+        span  = self._span
+        if type(span) is tuple:
+            # the offsets refer to the copy of the parent
+            parent = memo.get(id(span[0])) if span[0] is self._parent else None
+            span = (parent,)+span[1:] if parent is not None else self._get_span()
+        table._span = span
         memo[id(self)] = table
-        table.__doc__ = self.__doc__
+        if self.__doc__ is not type(self).__doc__:
+            table.__doc__ = self.__doc__
         for field in table._fields:
             if isinstance(field.value, T3Table):
                 c = field.value._treecopy(memo)
                 field.value = c
                 c._parent = table
+            elif isinstance(field.value, T3List):
+                field.value = T3List(item._treecopy(memo) if isinstance(item, T3Table) else item
+                                     for item in field.value)
+                field.value._set_parent(table)
         return table
 
 
@@ -409,11 +994,16 @@ class T3Table(object):
         :param name: name of T3Field to be updated
         :param value: value to be assigned to T3Field
         '''
-        self._get_root()._clear()
         field = self.__getitem__(name)
+        self._copy_on_write()
+        saved = [(r, r.schema, r.value, r.shared) for r in field]
+        log   = self._batch_log()
+        if log is not None:
+            log.save(self, saved)
         if len(field) == 1:
             if isinstance(value, T3List):
                 self._set_value_and_binding(field, value)
+                value._set_parent(self)
             elif isinstance(value, (list, tuple)):
                 if len(value) == 1:
                     self._set_value_and_binding(field, value[0])
@@ -442,14 +1032,80 @@ class T3Table(object):
                 raise ValueError("too many values to unpack. %d expected. %d received."%(len(field), len(value)))
         else:
             pass # TBD
-        for field in self._fields:
-            if field.name!=name and field.value_binding:
-                field.value = self._get_null_value()
+        if any(r.value_binding is not schema.value_binding for (r, schema, _, _) in saved):
+            try:
+                self._bindings = _checked_binding_order(self._fields)
+            except RuntimeError:
+                for r, schema, v, shared in saved:
+                    r.schema, r.value, r.shared = schema, v, shared
+                raise
+        self._modified(name)
+
+    def _modified(self, name):
+        # called after the value of the field ``name`` was changed. Within a batch the
+        # invalidation is deferred until the batch ends.
+        log = self._batch_log()
+        if log is not None:
+            log.modified(self, name)
+        else:
+            self._commit([name])
+
+    def _commit(self, names):
+        table = self
+        while table is not None:
+            table._changed()
+            table = table._parent
+        self._invalidate(names)
+
+    def _batch_log(self):
+        # the log of the batch of this table or of one of its parents
+        table = self
+        while table is not None:
+            if table._batch is not None:
+                return table._batch
+            table = table._parent
+
+    def batch(self):
+        '''
+        Context manager which defers the re-computation of bound fields until all
+        updates are done::
+
+            with tlv.batch():
+                tlv.Tag   = 0x9F02
+                tlv.Value = "01 02"
+
+        The updates of this table and of its nested tables are recorded. At the end
+        of the batch the bindings which read an updated field are invalidated once.
+        Bound values and table values read within the batch can be outdated. If the batch is left by
+        an exception the field updates are undone. Changes of T3Lists aren't undone.
+        '''
+        return _T3Batch(self)
+
+    def update(self, **fields):
+        '''
+        Sets several fields in one batch. See ``batch``.
+
+        :returns: this table.
+        '''
+        with self.batch():
+            for name, value in fields.items():
+                self.__setattr__(name, value)
+        return self
 
     def _auto_parent(self):
         for field in self._fields:
+            if field.shared:
+                continue
             if isinstance(field.value, T3Table):
                 field.value._parent = self
+            elif isinstance(field.value, T3List):
+                field.value._set_parent(self)
+
+    def _set_matched(self):
+        # records the bound fields whose values were set by a match and not computed
+        fields  = self._fields
+        matched = tuple(i for i in self._bindings if fields[i].value is not T3Number.NULL and fields[i].value is not None)
+        self._matched = matched or None
 
     def _to_string_top(self, name):
         return name+":"
@@ -457,7 +1113,7 @@ class T3Table(object):
     def _tostring(self, indent = 0):
         S = []
         for field in self._fields:
-            value = field.get_value()
+            value = field.value if field.shared else field.get_value()
             if field.value_binding:
                 name = "$"+field.name
             else:
@@ -489,14 +1145,65 @@ class T3Table(object):
             S+=self._tostring(4)
         return "\n".join(S)
 
+#################################### T3Batch ####################################
+
+class _T3BatchLog(object):
+    def __init__(self):
+        self.saved    = []
+        self.bindings = {}    # id(table) -> (table, _bindings before the batch)
+        self.names    = OrderedDict()   # id(table) -> (table, names of updated fields)
+
+    def save(self, table, saved):
+        self.saved.extend(saved)
+        if id(table) not in self.bindings:
+            self.bindings[id(table)] = (table, table._bindings)
+
+    def modified(self, table, name):
+        self.names.setdefault(id(table), (table, set()))[1].add(name)
+
+    def rollback(self):
+        for field, schema, value, shared in reversed(self.saved):
+            field.schema, field.value, field.shared = schema, value, shared
+        for table, bindings in self.bindings.values():
+            table._bindings = bindings
+
+    def commit(self):
+        for table, names in self.names.values():
+            table._commit(names)
+
+class _T3Batch(object):
+    def __init__(self, table):
+        self.table = table
+
+    def __enter__(self):
+        self.log = None
+        if self.table._batch_log() is None:
+            # an inner batch is part of the outer one
+            self.log = self.table._batch = _T3BatchLog()
+        return self.table
+
+    def __exit__(self, typ, value, tb):
+        if self.log is not None:
+            self.table._batch = None
+            if typ:
+                self.log.rollback()
+            self.log.commit()
+
 ################################# T3TableContext ################################
 
 class T3TableContext(T3Table):
     _cnt = 0
-    def __init__(self, name = None, default_valuetype = Hex, **options):
-        super(T3Response, self).__init__(default_valuetype, **options)
+    def __init__(self, name = None, default_valuetype = Hex):
+        super(T3TableContext, self).__init__()
         self._status = "OK"
         self._name   = name
+        self._valuetype = default_valuetype
+
+    def _coerce(self, v):
+        if isinstance(v, T3Number):
+            return v
+        else:
+            return self._valuetype(v)
 
     def __enter__(self):
         self._cnt+=1
@@ -522,6 +1229,261 @@ class T3TableContext(T3Table):
     def ok_message(self, value):
         pass
 
+######################################  T3Packrat ###################################
+
+_packrat = threading.local()
+
+class T3Packrat(object):
+    '''
+    Memoizes the results of T3Set field matches while it is active. Usage::
+
+        with T3Packrat(maxsize = 4096):
+            tree = T << data
+
+    A T3Set tries each of its remaining field patterns at every position. When sets are
+    nested in tables with overlapping prefixes the same pattern is tried at the same
+    position again and again. With an active T3Packrat each (pattern, position) pair is
+    matched once. At most ``maxsize`` results are kept, older ones are discarded first.
+    A result keeps the matched value, but no copy of the data.
+
+    A position is the offset of the data in the buffer of the parsed data. The memo
+    refers to one parse, it is cleared when data of another buffer is matched.
+    '''
+    def __init__(self, maxsize = 4096):
+        self.maxsize = maxsize
+        self.hits    = 0
+        self._memo   = OrderedDict()
+        self._buffer = None
+        self._outer  = None
+
+    def __enter__(self):
+        self._outer = getattr(_packrat, "active", None)
+        _packrat.active = self
+        return self
+
+    def __exit__(self, typ, value, tb):
+        _packrat.active = self._outer
+        self._memo.clear()
+        self._buffer = None
+
+    def __len__(self):
+        return len(self._memo)
+
+    def match(self, field, pattern, data):
+        '''
+        :param field: T3Field of a T3Set schema which owns ``pattern``. It is used as key.
+        :param pattern: T3Pattern to be matched against data.
+        :param data: T3Number
+        '''
+        if not isinstance(data, HexView) or data._buffer is None:
+            return pattern.match(data)
+        if data._buffer is not self._buffer:
+            # a new parse, the positions of the entries refer to another buffer
+            self._memo.clear()
+            self._buffer = data._buffer
+        # the data is given by its offsets in the buffer, so neither the data nor the
+        # rest of a match are kept
+        key   = (id(field), data._start, data._stop)
+        entry = self._memo.get(key)
+        if entry is not None and entry[0] is field:
+            self.hits+=1
+            _, value, size, need = entry
+            if size is None:
+                m = T3Match(None, data, fail = True)
+                m.need = need
+                return m
+            return T3Match(_copy_value(value), data[size:])
+        m = pattern.match(data)
+        if m.fail:
+            size = None
+        else:
+            size = len(data) - (len(m.rest) if m.rest is not None else 0)
+        # the entry keeps a reference to field, so its id can't be re-used during the parse
+        self._memo[key] = (field, m.value, size, m.need)
+        if len(self._memo)>self.maxsize:
+            self._memo.popitem(last = False)
+        return m
+
+def _copy_value(value):
+    if isinstance(value, T3Table):
+        return value._treecopy({})
+    elif isinstance(value, T3List):
+        return T3List(_copy_value(item) for item in value)
+    return value
+
+######################################  finditer ###################################
+
+if sys.version > '3':
+    _buffer_types = (bytes, bytearray, memoryview, mmap.mmap)
+else:
+    _buffer_types = (buffer, bytearray, memoryview, mmap.mmap)
+
+def _literal_prefix(pattern):
+    '''
+    Returns a pair (skip, literals) if each match of pattern starts with ``skip``
+    arbitrary bytes followed by one of the hex digit strings in ``literals``, None
+    otherwise.
+    '''
+    if isinstance(pattern, T3Repeater):
+        return _literal_prefix(pattern.table)
+    if isinstance(pattern, (T3Set, T3Bitmap)) or not isinstance(pattern, T3Table):
+        return
+    skip = 0
+    for field in pattern._fields:
+        if not field:
+            continue
+        P = field.pattern
+        if isinstance(P, t3.pattern.T3PatternPrefixed):
+            P = P.prefix
+        if isinstance(P, t3.pattern.T3PatternSection):
+            skip+=int(P.count)
+        elif isinstance(P, t3.pattern.T3PatternValue):
+            return skip, [Hex(P.value).digits()]
+        elif isinstance(P, t3.pattern.T3PatternAlt):
+            if not all(isinstance(Q, t3.pattern.T3PatternValue) for Q in P.patterns):
+                return
+            return skip, [Hex(Q.value).digits() for Q in P.patterns]
+        elif isinstance(P, T3Table):
+            prefix = _literal_prefix(P)
+            if prefix:
+                return skip + prefix[0], prefix[1]
+            return
+        else:
+            return
+
+def _as_view(data):
+    # matched data is kept as a HexView of one bytes object. The rest of a match and
+    # the matched data of a nested table are views of it and don't copy digits.
+    if type(data) is Hex:
+        return HexView.frombuffer(binascii.unhexlify(data._str))
+    return data
+
+def _map_file(path):
+    if os.path.getsize(path) == 0:
+        return T3Number.NULL
+    with open(path, "rb") as f:
+        buffer = mmap.mmap(f.fileno(), 0, access = mmap.ACCESS_READ)
+    # the map is closed when the last view which refers to it is gone
+    return HexView.frombuffer(buffer)
+
+def _to_number(coerce, data):
+    if isinstance(data, _buffer_types):
+        return Hex.frombytes(data)
+    return coerce(data)
+
+def _to_view(coerce, data):
+    # a HexView of the data. A bytes object or an mmap is used as buffer, other
+    # bytes-like objects may be changed later and are copied once.
+    if isinstance(data, _buffer_types):
+        if not isinstance(data, (bytes, mmap.mmap)):
+            data = memoryview(data).tobytes()
+        return HexView.frombuffer(data)
+    data = coerce(data)
+    if isinstance(data, HexView) and data._buffer is None:
+        return HexView.frombuffer(binascii.unhexlify(data._str))
+    return _as_view(data)
+
+def _finditer(pattern, coerce, buffer, overlapped):
+    data   = _to_view(coerce, buffer)
+    prefix = _literal_prefix(pattern) if isinstance(data, HexView) else None
+    if prefix:
+        # the literals are searched in the bytes of the buffer
+        skip, literals = prefix
+        literals = [binascii.unhexlify(literal) for literal in literals]
+        buffer, offset, stop = data._buffer, data._start, data._stop
+    found = {}   # literal -> buffer offset of its next occurrence or -1
+    n   = len(data)
+    pos = 0
+    while pos<n:
+        if prefix:
+            start = offset+pos+skip
+            k = -1
+            for literal in literals:
+                i = found.get(literal, start)
+                if 0<=i<start or literal not in found:
+                    i = found[literal] = buffer.find(literal, start, stop)
+                if i>=0 and (k<0 or i<k):
+                    k = i
+            if k<0:
+                return
+            pos = k-offset-skip
+        m = pattern.match(data[pos:])
+        if not m.fail:
+            size = n-pos-(len(m.rest) if m.rest is not None else 0)
+            if size>0:
+                yield pos, m.value
+                if not overlapped:
+                    pos+=size
+                    continue
+        pos+=1
+
+######################################  projections ###################################
+
+_SKIP = object()
+
+def _projection(fields):
+    # ["Tag", "Hdr.Seq"] -> {"Tag": None, "Hdr": {"Seq": None}} where None selects a whole field
+    if isinstance(fields, dict):
+        return fields
+    tree = {}
+    for path in fields:
+        node  = tree
+        names = path.split(".")
+        for name in names[:-1]:
+            node = node.setdefault(name, {})
+            if node is None:
+                break
+        else:
+            node[names[-1]] = None
+    return tree
+
+def _is_plain_table(P):
+    return isinstance(P, T3Table) and not isinstance(P, (T3Set, T3Bitmap))
+
+def _fixed_size(P):
+    # size of the data matched by P if it consists of sections only or if P is a
+    # matcher with a ``size`` attribute, e.g. the matcher of a constructed BER-TLV value
+    if isinstance(P, t3.pattern.T3PatternSection):
+        return int(P.count)
+    if isinstance(P, T3Pattern) and not isinstance(P, (T3Table, T3Repeater)):
+        size = getattr(P, "size", None)
+        if size is not None:
+            return int(size)
+    if isinstance(P, T3Bitmap):
+        if all(isinstance(field.pattern, t3.pattern.T3PatternSection) for field in P._fields if field):
+            return P._byte_size()
+    elif _is_plain_table(P):
+        size = 0
+        for field in P._fields:
+            if field:
+                k = _fixed_size(field.pattern)
+                if k is None:
+                    return
+                size+=k
+        return size
+
+def _match_projected(P, data, projection):
+    if projection is _SKIP:
+        if isinstance(P, t3.pattern.T3PatternSection):
+            return P.match(data)
+        size = _fixed_size(P)
+        if size is not None:
+            value = data[:size]
+            if len(value)<size:
+                m = T3Match(None, data, fail = True)
+                m.need = size - len(value)
+                return m
+            return T3Match(T3LazyValue(P, value), data[size:])
+        if _is_plain_table(P) or isinstance(P, T3Repeater):
+            m = P.match(data, ())
+            if not m.fail:
+                n = len(m.rest) if m.rest is not None else 0
+                m.value = T3LazyValue(P, data[:len(data)-n])
+            return m
+    elif projection and (_is_plain_table(P) or isinstance(P, T3Repeater)):
+        return P.match(data, projection)
+    return P.match(data)
+
 ######################################  T3Set ###################################
 
 class T3Set(T3Table):
@@ -544,28 +1506,42 @@ class T3Set(T3Table):
         self.add(value._fields[0].value, **prefixed_pattern)
 
 
-    def match(self, data):
-        data   = self._coerce(data)
-        R      = data
-        table  = self.__class__()
-        fields = [copy(field) for field in self._fields if field]
-        n      = len(fields)
+    def match(self, data, fields = None):
+        # fields is accepted like by T3Table.match, e.g. from a T3Repeater, but a set
+        # builds all of its fields
+        data    = _as_view(self._coerce(data))
+        R       = data
+        table   = self.__class__()
+        sources = [field for field in self._fields if field]
+        fields  = [copy(field) for field in sources]
+        packrat = getattr(_packrat, "active", None)
         while True:
+            need = 0
             for i, field in enumerate(fields):
-                m = field.pattern.match(R)
+                if packrat is None:
+                    m = field.pattern.match(R)
+                else:
+                    m = packrat.match(sources[i], field.pattern, R)
                 if not m.fail:
                     field.value = m.value
                     table.add(field)
                     R = m.rest
                     break
+                if m.need and (not need or m.need<need):
+                    need = m.need
             else:
-                return T3Match(None, R, fail = True)
+                m = T3Match(None, R, fail = True)
+                m.need = need
+                return m
             del fields[i]
+            del sources[i]
             # TODO: partial match is o.k. when R is NULL?
             if fields and R:
                 continue
             else:
                 table._auto_parent()
+                table._set_matched()
+                table._set_span(data, R)
                 return T3Match(table, R)
 
 ######################################  T3Repeater ###################################
@@ -576,14 +1552,21 @@ class T3Repeater(object):
         self._min  = minimum
         self._max  = maximum
 
-    def match(self, data):
-        data = self.table._coerce(data)
+    def match(self, data, fields = None):
+        '''
+        :param fields: optional field names which are passed to the ``match`` of each
+                       table. See ``T3Table.match``.
+        '''
+        data = _as_view(self.table._coerce(data))
         m    = T3Match(None, data)
         R    = m.rest
         lst  = T3List()
         i = 0
         while i<self._max:
-            m = self.table.match(R)
+            if fields is None:
+                m = self.table.match(R)
+            else:
+                m = self.table.match(R, fields)
             if m.fail:
                 if i<self._min:
                     return m
@@ -595,6 +1578,56 @@ class T3Repeater(object):
             i+=1
         return T3Match(lst, R)
 
+    def push_parser(self):
+        '''
+        :returns: T3PushParser which parses the tables of this repeater when they are fed
+                  in chunks. The ``minimum`` is checked by ``close()``, tables beyond the
+                  ``maximum`` are not parsed.
+        '''
+        return T3PushParser(self.table, self._min, self._max)
+
+    def iter_from(self, fileobj):
+        '''
+        Iterator over the tables of this repeater read from a binary file object. See
+        ``T3Table.read_from``. Reading stops after ``maximum`` tables, the ``minimum``
+        is checked at the end of the file.
+        '''
+        return _read_tables(self.push_parser(), fileobj)
+
+    def parse_file(self, path):
+        '''
+        Matches the content of a file. See ``T3Table.parse_file``.
+        '''
+        return self << _map_file(path)
+
+    def iterparse(self, source, chunksize = 4096):
+        '''
+        Parses the tables of this repeater one at a time.
+
+        :param source: T3Number, bytes-like object or binary file.
+        :param chunksize: number of bytes which are read from ``source`` at once.
+        :returns: iterator over the tables. When it is exhausted its ``offset`` attribute
+                  is the byte offset of the unconsumed rest of ``source``.
+        :raises MatchingFailure: if fewer than ``minimum`` tables are found.
+
+        Other than ``match`` no T3List is built and the memory used doesn't depend on the
+        size of ``source``.
+        '''
+        return _T3IterParser(self, source, chunksize)
+
+    def finditer(self, buffer, overlapped = False):
+        '''
+        Scans ``buffer`` for runs of tables. See ``T3Table.finditer``.
+        '''
+        return _finditer(self, self.table._coerce, buffer, overlapped)
+
+    def compile(self, debug = False):
+        '''
+        Generates a specialized match function for this repeater. See ``T3Table.compile``.
+        '''
+        from t3.codegen import compile_matcher
+        return compile_matcher(self, debug)
+
     def __lshift__(self, data):
         m = self.match(data)
         if not m:
@@ -602,9 +1635,207 @@ class T3Repeater(object):
         else:
             return m.value
 
+######################################  T3PushParser ###################################
+
+def _is_bounded(P):
+    # False if a match of P can grow when data is appended
+    if isinstance(P, (T3Repeater, T3Set, T3List, t3.pattern.T3PatternAny)):
+        return False
+    if isinstance(P, t3.pattern.T3PatternPrefixed):
+        return _is_bounded(P.pattern)
+    if isinstance(P, T3Table):
+        return all(_is_bounded(field.pattern) for field in P._fields if field)
+    return True
+
+class T3PushParser(object):
+    '''
+    Parses a stream of tables which arrives in chunks::
+
+        parser = Tlv.push_parser()
+        for chunk in chunks:
+            for tlv in parser.feed(chunk):
+                ...
+        parser.close()
+
+    Only the bytes of the table which is currently parsed are buffered. If a match
+    fails because data ended early it is retried when the missing bytes arrived.
+
+    A reader which reads ``parser.missing`` bytes at a time, e.g. a protocol of an
+    event loop, reads no bytes beyond the end of a table.
+    '''
+    def __init__(self, table, minimum = 0, maximum = MAXSIZE):
+        self.table    = table
+        self.count    = 0
+        self._min     = minimum
+        self._max     = maximum
+        self._digits  = ''
+        self._need    = 0   # number of buffered bytes required for the next match
+        self._bounded = _is_bounded(table)
+
+    def __len__(self):
+        return len(self._digits)//2
+
+    @property
+    def missing(self):
+        '''
+        The number of bytes which are at least missing to complete the next table. A
+        reader which feeds exactly ``missing`` bytes never reads beyond the end of a
+        table, unless the table ends with an unbounded pattern.
+        '''
+        return max(self._need - len(self), 1)
+
+    @property
+    def rest(self):
+        '''
+        The buffered bytes which are not yet parsed.
+        '''
+        if self._digits:
+            return Hex._fromdigits(self._digits, 16)
+        return T3Number.NULL
+
+    def feed(self, chunk):
+        '''
+        :param chunk: T3Number or bytes-like object.
+        :returns: list of the tables which were completed by ``chunk``.
+        :raises MatchingFailure: if the buffered bytes can't start a table.
+        :raises ValueError: if ``maximum`` tables were parsed already.
+        '''
+        if self.count>=self._max:
+            # nothing more is buffered
+            raise ValueError("maximum number of tables parsed")
+        chunk = _to_number(self.table._coerce, chunk)
+        if len(chunk):
+            self._digits+=Hex(chunk).digits()
+        return self._parse(False)
+
+    def close(self):
+        '''
+        Signals the end of the stream.
+
+        :returns: list of the remaining tables.
+        :raises MatchingFailure: if there are bytes left which don't form a table or fewer
+                                 than ``minimum`` tables were parsed.
+        '''
+        tables = self._parse(True)
+        if self._digits and self.count<self._max:
+            # a failure which was deferred for the sake of completed tables
+            tables+=self._parse(True)
+        if self.count<self._min:
+            raise MatchingFailure(T3Match(None, self.rest, fail = True))
+        return tables
+
+    def _parse(self, final):
+        tables = []
+        data   = self.rest
+        while self.count<self._max and len(data) and (final or len(data)>=self._need):
+            m = self.table.match(data)
+            if not m.fail:
+                R = m.rest if m.rest is not None else T3Number.NULL
+                if len(R) or final or self._bounded:
+                    tables.append(m.value)
+                    self.count+=1
+                    self._need = 0
+                    data = R
+                    continue
+                # the table might grow with the next chunk
+                m.need = 1
+            if m.need and not final:
+                self._need = len(data)+m.need
+                break
+            if tables:
+                # report completed tables first, the failure is raised by the next call
+                self._need = 0
+                break
+            self._digits = data.digits()
+            raise MatchingFailure(m)
+        self._digits = data.digits() if len(data) else ''
+        return tables
+
+def _read_tables(parser, fileobj):
+    # reads exactly the bytes which are missing for the next table of parser
+    while parser.count<parser._max:
+        chunk = fileobj.read(parser.missing)
+        if not chunk:
+            for table in parser.close():
+                yield table
+            return
+        for table in parser.feed(Hex.frombytes(chunk)):
+            yield table
+
+def _iter_chunks(coerce, source, size):
+    if hasattr(source, "read"):
+        while True:
+            chunk = source.read(size)
+            if not chunk:
+                return
+            yield Hex.frombytes(chunk)
+    elif isinstance(source, _buffer_types):
+        for i in range(0, len(source), size):
+            yield Hex.frombytes(source[i:i+size])
+    else:
+        data = coerce(source)
+        if data.base!=16:
+            yield data
+            return
+        digits = data.digits()
+        for i in range(0, len(digits), 2*size):
+            yield Hex._fromdigits(digits[i:i+2*size], 16)
+
+class _T3IterParser(object):
+    '''
+    Iterator returned by T3Repeater.iterparse.
+    '''
+    def __init__(self, repeater, source, chunksize):
+        self.offset  = 0
+        self._parser = repeater.push_parser()
+        self._chunks = _iter_chunks(repeater.table._coerce, source, chunksize)
+        self._tables = []
+        self._fed    = 0
+        self._done   = False
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        while not self._tables:
+            if self._done:
+                raise StopIteration
+            self._tables = self._next_tables()[::-1]
+        return self._tables.pop()
+
+    next = __next__
+
+    def _next_tables(self):
+        parser = self._parser
+        tables = []
+        try:
+            chunk = next(self._chunks, None)
+            if chunk is None:
+                self._done = True
+                tables = parser.close()
+            else:
+                self._fed+=len(chunk)
+                tables = parser.feed(chunk)
+        except MatchingFailure:
+            if parser.count<parser._min:
+                raise
+            # like T3Repeater.match the iteration ends at the first mismatch
+            self._done = True
+        if parser.count>=parser._max:
+            self._done = True
+        self.offset = self._fed - len(parser)
+        return tables
+
 ######################################  T3List ###################################
 
 class T3List(list):
+    '''
+    List of field values, usually tables. A T3List which is the value of a field knows
+    the table of the field. Changing the list counts as an update of this field.
+    '''
+    _table   = None
+    _sharers = None   # fields of copies which share this list
+
     def _coerce(self, rowvalue):
         if isinstance(rowvalue, T3Number):
             return rowvalue
@@ -614,8 +1845,35 @@ class T3List(list):
     def get_value(self):
         return Hex(self.join())
 
+    def byte_length(self):
+        return sum(_byte_length(item) for item in self)
+
+    def _set_parent(self, table):
+        # tables in a list which is a field value have the table of the field as parent
+        self._table = table
+        for item in self:
+            if isinstance(item, T3Table):
+                item._parent = table
+
+    def _modified(self, items = ()):
+        table = self._table
+        if table is None:
+            return
+        for item in items:
+            if isinstance(item, T3Table):
+                item._parent = table
+        field = table._holder(self)
+        if field is not None:
+            table._modified(field.name)
+
     def join(self):
-        return reduce(lambda x, y: Hex(x) // Hex(y), self)
+        if not self:
+            raise TypeError("can't join an empty T3List")
+        values = []
+        for item in self:
+            v = item.get_value() if isinstance(item, T3Value) else item
+            values.append(v if isinstance(v, Hex) else Hex(v))
+        return _concat(values)
 
     def __floordiv__(self, other):
         if isinstance(other, T3List):
@@ -624,7 +1882,7 @@ class T3List(list):
             return T3List(self+[other])
 
     def match(self, data):
-        data = self._coerce(data)
+        data = _as_view(self._coerce(data))
         m = T3Match(T3Number.NULL, data)
         lst = T3List()
         R = m.rest
@@ -654,6 +1912,44 @@ class T3List(list):
         html.append("</table>")
         return ''.join(html)
 
+def _list_mutator(name, added = None):
+    # wraps the list method ``name`` with a call of T3List._modified. added(args)
+    # returns the arguments and the items which are added to the list.
+    method = getattr(list, name)
+    def mutator(self, *args):
+        if self._table is not None:
+            self._table._copy_on_write()
+        items = ()
+        if added:
+            args, items = added(args)
+        res = method(self, *args)
+        self._modified(items)
+        return res
+    mutator.__name__ = name
+    return mutator
+
+def _item_arg(args):
+    return args, args[-1:]
+
+def _items_arg(args):
+    # an iterator is consumed only once
+    items = list(args[-1])
+    return args[:-1]+(items,), items
+
+def _setitem_arg(args):
+    if isinstance(args[0], slice):
+        return _items_arg(args)
+    return _item_arg(args)
+
+for _name, _added in [("append", _item_arg), ("insert", _item_arg), ("extend", _items_arg),
+                      ("__iadd__", _items_arg), ("__setitem__", _setitem_arg),
+                      ("__setslice__", _items_arg), ("pop", None), ("remove", None),
+                      ("__delitem__", None), ("__delslice__", None), ("__imul__", None),
+                      ("sort", None), ("reverse", None)]:
+    if hasattr(list, _name):
+        setattr(T3List, _name, _list_mutator(_name, _added))
+del _name, _added
+
 #####################################  T3Bitmap ###################################
 
 class T3Bitmap(T3Table):
@@ -668,7 +1964,31 @@ class T3Bitmap(T3Table):
         else:
             return Bin(rowvalue)
 
-    def match(self, data):
+    def byte_length(self):
+        bits = 0
+        for field in self._fields:
+            if field:
+                bits+=int(field.pattern.count)
+        return (bits+7)//8
+
+    def _byte_size(self):
+        # size of the bitmap in bytes or None if it isn't a whole number of bytes
+        bits = 0
+        for field in self._fields:
+            if field:
+                bits+=int(field.pattern.count)
+        if bits and bits%8 == 0:
+            return bits//8
+
+    def match(self, data, fields = None):
+        # like a T3Set a bitmap builds all of its fields
+        if isinstance(data, Hex):
+            # convert only the bytes of the bitmap instead of all data
+            size = self._byte_size()
+            if size and len(data)>size:
+                m = self.match(Bin(data[:size]).zfill(8*size))
+                m.rest = data if m.fail else data[size:]
+                return m
         if not (isinstance(data, T3Number) and data.base == 2):
             bits = Bin(data)
             k = len(bits)%8
@@ -677,13 +1997,16 @@ class T3Bitmap(T3Table):
         else:
             bits = data
         m = super(T3Bitmap, self).match(bits)
-        if m.rest and isinstance(data, T3Number):
+        if m.fail and bits is not data:
+            m.need = (m.need+7)//8
+        if m.rest is not None and len(m.rest) and isinstance(data, T3Number):
             if data.base!=2:
                 R  = data.__class__(m.rest.bytes(), data.base)
                 m.rest = R
         return m
 
     def add(self, pattern = None, **kwds):
+        self._copy_on_write()
         if isinstance(pattern, int):
             k = pattern
             p = t3.pattern.T3PatternSection(k)
@@ -701,16 +2024,19 @@ class T3Bitmap(T3Table):
         field = self._new_field(p, kwds)
         if field.name in T3Bitmap.__dict__ or field.name in self.__dict__:
             raise TypeError("can't add field which has a T3Bitmap attribute name: '%s'"%field.name)
+        if field.value_binding:
+            self._bindings = _checked_binding_order(self._fields+[field])
         field.table = self
         self._fields.append(field)
-        k = self._fieldnames.get(field.name, 0)
-        self._fieldnames[field.name] = k+1
+        self._index_field(field)
+        self._size = self._span = None
         return self
 
     def _to_string_top(self, name):
         return name+": %s"%Bin(self)
 
     def get_value(self):
+        self._eval_bindings()
         value = []
         for field in self._fields:
             if field:
@@ -728,6 +2054,16 @@ class T3Bitmap(T3Table):
 
 #####################################  T3Bitset ###################################
 
+class _T3BitsetFormatter(object):
+    # formatter of a matched bitset value which shows the name of the value.
+    # Unlike a closure it can be pickled together with the value
+    def __init__(self, formatter, name):
+        self.formatter = formatter
+        self.name = name
+
+    def __call__(self, n):
+        return self.formatter(n) + "  ==> "+self.name
+
 class T3Bitset(object):
     def __init__(self, bitcount):
         self.count = bitcount
@@ -762,8 +2098,7 @@ class T3Bitset(object):
         if len(value) == self.count:
             name = self.fields.get(value.digits())
             if name:
-                f = value.formatter
-                value.set_formatter(lambda n: f(n) + "  ==> "+name)
+                value.set_formatter(_T3BitsetFormatter(value.formatter, name))
                 m = T3Match(value, bits[self.count:])
         else:
             m = T3Match(None, data, fail = True)
@@ -782,6 +2117,7 @@ T3Value.register(T3Table)
 T3Value.register(T3Binding)
 T3Value.register(T3Field)
 T3Value.register(T3List)
+T3Value.register(T3LazyValue)
 
 T3Pattern.register(T3Table)
 T3Pattern.register(T3Repeater)
@@ -1022,6 +2358,494 @@ def test_set():
     H = Hex(X)
     assert Hex(X << H) == H
 
+def test_fieldindex():
+    print("call: test_fieldindex()")
+    T = T3Table()
+    T.add(1, A = "01")
+    T.add(1, B = "02")
+    T.add(1, A = "03")
+    assert T["B"] is T._fields[1]
+    assert [field.value for field in T["A"]] == ["01", "03"]
+    # copies share the index until a field is added
+    R = copy(T)
+    assert R._fieldindex is T._fieldindex
+    assert R["B"] is R._fields[1]
+    R.add(1, C = "04")
+    assert R.C == "04"
+    assert "C" not in T
+    assert R._fieldindex is not T._fieldindex
+    R = T << "05 06 07"
+    assert R._fieldindex is T._fieldindex
+    assert R.B == "06"
+
+def test_field_schema():
+    print("call: test_field_schema()")
+    import pickle
+    Tlv = _build_tlv()
+    R = Tlv << "A7 02 03 05 06"
+    assert all(F.schema is G.schema for (F, G) in zip(R._fields, Tlv._fields))
+    assert not hasattr(R._fields[0], "__dict__")
+    # changing the schema of a field doesn't change the schema of the copies
+    R["Value"].pattern = 1
+    assert R["Value"].schema is not Tlv["Value"].schema
+    assert Tlv["Value"].pattern is not R["Value"].pattern
+    T = T3Table().add(1, A = "00").add(2, B = "00")
+    R = T << "01 02 03"
+    for protocol in (0, 2):
+        S = pickle.loads(pickle.dumps(R, protocol))
+        assert Hex(S) == "01 02 03"
+        assert S.B == "02 03"
+
+def test_pathcopy():
+    print("call: test_pathcopy()")
+    Tlv = _build_tlv()
+    Rec = T3Table()
+    Rec.add(Left  = Tlv(Tag = 0xA1, Value = Tlv(Tag = 0x81, Value = "01")))
+    Rec.add(Right = Tlv(Tag = 0xA2, Value = Tlv(Tag = 0x82, Value = "02")))
+    H = Hex(Rec)
+    V = Rec.Right.Value(Value = "02 03")
+    assert Hex(Rec) == H
+    assert Hex(V) == "A1 03 81 01 01 A2 04 82 02 02 03"
+    # only the path to the updated table is copied
+    assert V["Left"].value is Rec["Left"].value
+    assert V["Right"].value is not Rec["Right"].value
+    # a shared table is copied when it is accessed
+    V.Left.Value.Value = "FF"
+    assert Hex(V) == "A1 03 81 01 FF A2 04 82 02 02 03"
+    assert Hex(Rec) == H
+    W = V(Right = Tlv(Tag = 0x83, Value = "04"))
+    assert Hex(W) == "A1 03 81 01 FF 83 01 04"
+    assert Hex(V) == "A1 03 81 01 FF A2 04 82 02 02 03"
+    # updates of the prototype don't change the copy
+    Rec.Left.Value.Value = "EE"
+    assert Hex(V) == "A1 03 81 01 FF A2 04 82 02 02 03"
+    P = Tlv(Tag = 0x70, Value = Tlv(Tag = 0x80, Value = "01"))
+    Q = P(Tag = 0x71)
+    P.Value.Value = "02 03"
+    assert Hex(P) == "70 04 80 02 02 03"
+    assert Hex(Q) == "71 03 80 01 01"
+    # copies don't change the prototype, a reference to a nested table stays valid
+    P = Tlv(Tag = 0x70, Value = Tlv(Tag = 0x80, Value = "01"))
+    v = P.Value
+    Q = P(Tag = 0x71)
+    assert P.Value is v
+    R = v(Value = "02")
+    v.Value = "05 05"
+    assert P.Value is v and Hex(P) == "70 04 80 02 05 05"
+    assert Hex(Q) == "71 03 80 01 01" and Hex(R) == "70 03 80 01 02"
+    # copies of one prototype made by several threads
+    P = Tlv(Tag = 0x70, Value = Tlv(Tag = 0xA5, Value = Tlv(Tag = 0x80, Value = "01")))
+    errors = []
+    def run(k):
+        try:
+            for i in range(50):
+                V = P.Value.Value(Value = "%02X"%k)
+                assert Hex(V) == "70 05 A5 03 80 01 %02X"%k
+        except Exception as e:
+            errors.append(e)
+    threads = [threading.Thread(target = run, args = (k,)) for k in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert not errors, errors
+    assert Hex(P) == "70 05 A5 03 80 01 01"
+
+def test_invalidate():
+    print("call: test_invalidate()")
+    Tlv = _build_tlv()
+    Rec = T3Table()
+    Rec.add(Left  = Tlv(Tag = 0xA1, Value = Tlv(Tag = 0x81, Value = "01")))
+    Rec.add(Right = Tlv(Tag = 0xA2, Value = Tlv(Tag = 0x82, Value = "02")))
+    Rec.add(1, Size = T3Binding(lambda v: Hex(len(v)), "*"))
+    Rec.add(Left2 = Tlv(Tag = 0xA3, Value = "03"))
+    Rec.Left2 = Tlv << "A3 01 03"
+    Rec.Right.Value.Value = "02 03"
+    # bindings which read the updated field are re-computed, up to the root
+    assert Rec.Right.Value.Len == 2
+    assert Rec.Right.Len == 4
+    assert Rec.Size == 3
+    # other bindings keep their values
+    assert Rec.Left2["Len"].value == 1
+    Rec.Left2.Tag = 0xA4
+    assert Rec.Left2["Len"].value == T3Number.NULL
+    assert Rec.Left2.Len == 1
+    # matched values of bindings are dropped once, computed values are kept
+    T = T3Table()
+    T.add(1, A = "01")
+    T.add(1, B = "02")
+    T.add(1, LenA = T3Binding(lambda v: Hex(len(v)), "A"))
+    assert T.LenA == 1
+    T.B = "03 03"
+    assert T["LenA"].value == 1
+    R = T << "01 02 05"
+    assert R["LenA"].value == 5
+    R.B = "04"
+    assert R["LenA"].value == T3Number.NULL
+    assert R.LenA == 1
+    R.B = "05"
+    assert R["LenA"].value == 1
+    R2 = (T << "01 02 05")(B = "04")
+    assert R2.LenA == 1
+
+def test_batch():
+    print("call: test_batch()")
+    calls = []
+    def size(v):
+        calls.append(v)
+        return Hex(len(v))
+    T = T3Table()
+    T.add(1, Len = T3Binding(size, "*"))
+    for name in "ABCD":
+        T.add(1, **{name: "00"})
+    assert Hex(T) == "04 00 00 00 00"
+    del calls[:]
+    assert T.update(A = "01", B = "02 02", C = "03") is T
+    assert calls == []
+    assert Hex(T) == "05 01 02 02 03 00"
+    assert len(calls) == 1
+    # an exception undoes the updates of the batch
+    try:
+        with T.batch():
+            T.A = "FF"
+            T.B = T3Binding(size, "Len")
+    except RuntimeError:
+        pass
+    assert Hex(T) == "05 01 02 02 03 00"
+    # updates of nested tables are part of the batch
+    Tlv = _build_tlv()
+    R = Tlv(Tag = 0xA1, Value = Tlv(Tag = 0x81, Value = "01"))
+    with R.batch():
+        R.Value.Value = "01 02"
+        R.Tag = 0xA2
+        assert R._batch_log() is R.Value._batch_log()
+    assert Hex(R) == "A2 04 81 02 01 02"
+
+    with T3TableContext("Select") as C:
+        C.add(1, Ins = 0xA4)
+    assert C._status == "OK"
+    assert Hex(C) == "A4"
+
+def test_span():
+    print("call: test_span()")
+    Tlv = _build_tlv()
+    T = T3Table()
+    T.add(1, Tag = "00")
+    T.add(Tlv, Outer = Tlv)
+    data = Hex("01 A1 03 01 02 03")
+    R = T << data
+    # an unchanged table is serialized from the matched data
+    assert R._span is not None and R.Outer._span is not None
+    assert Hex(R) == data
+    assert R.byte_length() == 6
+    R.Outer.Value = "04"
+    assert R._span is None and R.Outer._span is None
+    assert Hex(R) == "01 A1 01 04"
+    assert R.byte_length() == 4
+    R = T << data
+    R.add(1, Extra = "FF")
+    assert Hex(R) == data // "FF"
+    # only the matched bytes are kept, not the rest of the data
+    R = T << data // "FF FF"
+    assert R._span == data and R.Outer._span == "A1 03 01 02 03"
+    # the spans of nested tables are views of the same buffer
+    assert isinstance(R.Outer._span, HexView) and R.Outer._span._buffer is R._span._buffer
+    Flags = T3Bitmap().add(4, A = 0).add(4, B = 0)
+    T = T3Table().add(1, Tag = 0).add(Flags, Flags = Flags)
+    R = T << "01 8F 00"
+    assert Hex(R) == "01 8F"
+    assert R.byte_length() == 2
+
+def test_reserialize():
+    print("call: test_reserialize()")
+    Tlv = _build_tlv()
+    T = T3Table()
+    T.add(Tlv, First = Tlv)
+    T.add(Tlv, Second = Tlv)
+    R = T << Hex("A1 01 05 A2 02 06 07")
+    span = R.Second._span
+    R.First.Value = "08 09"
+    # only the updated table and its parents are serialized again
+    assert R.Second._span is span
+    assert Hex(R) == "A1 02 08 09 A2 02 06 07"
+    assert R._span is not None and R.First._span is not None
+    # only the serialized table keeps its encoding, the nested tables keep offsets in it
+    assert R.Second._span == (R, 4, 8) and R.Second._get_span() == span
+    assert R.First._span == (R, 0, 4)
+    assert R.byte_length() == 8
+    R.Second.Value = "0A"
+    assert R.First._span is not None
+    assert Hex(R) == "A1 02 08 09 A2 01 0A"
+    L = T3List([Hex("01"), R, Hex("02 03")])
+    assert Hex(L) == "01 A1 02 08 09 A2 01 0A 02 03"
+    # a built tree keeps one encoding
+    Tlv = _build_tlv()
+    Inner = Tlv(Tag = 0x81, Value = "01 02")
+    Outer = Tlv(Tag = 0xA1, Value = Tlv(Tag = 0xA2, Value = Inner))
+    assert Hex(Outer) == "A1 06 A2 04 81 02 01 02"
+    assert Outer.Value._span == (Outer, 2, 8) and Outer.Value.Value._span == (Outer.Value, 2, 6)
+    assert Outer.Value.Value._get_span() == "81 02 01 02"
+    Outer.Value.Value.Value = "03"
+    assert Hex(Outer) == "A1 05 A2 03 81 01 03"
+    C = Outer(Tag = 0xA3)
+    assert Hex(C) == "A3 05 A2 03 81 01 03" and Hex(C.Value) == "A2 03 81 01 03"
+
+def test_packrat():
+    print("call: test_packrat()")
+    Tlv = _build_tlv()
+    X = T3Set()
+    X.add(0x9F01, F_9F01 = Tlv(Tag = 0x9F01))
+    X.add(0x9F02, F_9F02 = Tlv(Tag = 0x9F02))
+    X.add(0x9F03, F_9F03 = Tlv(Tag = 0x9F03))
+    Tpl = Tlv(Tag = 0x70, Value = X)
+    A = T3Table().add(Tpl, Tpl = Tpl).add('AA', Trailer = 'AA')
+    B = T3Table().add(Tpl, Tpl = Tpl).add('BB', Trailer = 'BB')
+    Y = T3Set()
+    Y.add(0x70, A = A)
+    Y.add(0x70, B = B)
+    data = '70 0C 9F 03 01 03 9F 01 01 01 9F 02 01 02 BB'
+    R = Y << data
+    with T3Packrat() as packrat:
+        R2 = Y << data
+        assert packrat.hits > 0
+    assert Hex(R2) == Hex(R) == data
+    assert R2.B.Tpl.Value.F_9F02.Value == 0x02
+    R2.B.Tpl.Value.F_9F02.Value = '02 02'
+    assert Hex(R2) == '70 0D 9F 03 01 03 9F 01 01 01 9F 02 02 02 02 BB'
+    with T3Packrat(maxsize = 2) as packrat:
+        assert Hex(Y << data) == data
+        assert len(packrat) <= 2
+    # data of the same length at the same position is matched again
+    other = '70 0C 9F 03 01 04 9F 01 01 05 9F 02 01 06 BB'
+    with T3Packrat() as packrat:
+        assert Hex(Y << data) == data
+        R2 = Y << other
+        assert Hex(R2) == other
+        # the memo refers to the last parse only
+        assert packrat._buffer is R2._span._buffer
+        # the memo doesn't keep the matched data or its rest
+        assert not any(isinstance(v, T3Number) for entry in packrat._memo.values() for v in entry)
+    assert getattr(_packrat, "active", None) is None
+
+def test_finditer():
+    Rec = T3Table()
+    Rec.add("A5 5A", Magic = "A5 5A")
+    Rec.add(1, Len = 0)
+    Rec.add(lambda rec, data: rec.Len.number(), Data = 0)
+    # '0A 55 A0' contains the magic digits 'A55A' off a byte boundary
+    data = Hex("00 0A 55 A0 A5 5A 02 11 22 FF A5 5A 01 33 A5 5A 02 A5 5A 01 44")
+    found = [(pos, rec.Data) for pos, rec in Rec.finditer(data)]
+    assert found == [(4, 0x1122), (10, 0x33), (14, 0xA55A)], found
+    # compare with matching at each offset
+    found = [pos for pos, rec in Rec.finditer(data, overlapped = True)]
+    expected = [pos for pos in range(len(data)) if not Rec.match(data[pos:]).fail]
+    assert found == expected == [4, 10, 14, 17], found
+    assert [pos for pos, rec in Rec.finditer(bytearray(data.ascii()))] == [4, 10, 14]
+    # a buffer is searched and matched without converting it to hex digits
+    pos, rec = next(Rec.finditer(bytearray(data.ascii())))
+    assert pos == 4 and isinstance(rec._span, HexView) and rec._span._s is None
+
+    Hdr = T3Table()
+    Hdr.add(2, Seq = 0)
+    Hdr.add("01|02", Kind = "01")
+    Msg = T3Table()
+    Msg.add(Hdr, Hdr = Hdr)
+    Msg.add(1, Value = 0)
+    assert _literal_prefix(Msg) == (2, ["01", "02"])
+    data = Hex("01 00 07 02 55 00 08 01 66 03")
+    assert [(pos, msg.Hdr.Seq) for pos, msg in Msg.finditer(data)] == [(1, 7), (5, 8)]
+
+    Msgs = T3Repeater(Msg)
+    assert [(pos, len(lst)) for pos, lst in Msgs.finditer(data)] == [(1, 2)]
+
+    Any = T3Table().add(1, B = 0)
+    assert _literal_prefix(Any) is None
+    assert [pos for pos, b in Any.finditer("00 01 02")] == [1, 2]
+
+def test_push_parser():
+    Tlv  = _build_tlv()
+    data = Hex("01 02 11 22 9F 10 01 33 02 81 81 "+"44"*0x81+" 03 00")
+    tlvs = T3Repeater(Tlv) << data
+    for size in (1, 2, 3, 7, len(data)):
+        parser = Tlv.push_parser()
+        parsed = []
+        for i in range(0, len(data), size):
+            chunk = data[i:i+size]
+            parsed+=parser.feed(chunk)
+            assert len(parser)<0x81+3+size
+        parsed+=parser.close()
+        assert [Hex(tlv) for tlv in parsed] == [Hex(tlv) for tlv in tlvs]
+        assert parser.rest is T3Number.NULL
+
+    # tables are returned as soon as their last byte arrives
+    parser = Tlv.push_parser()
+    assert parser.feed("01") == []
+    assert parser.feed("02 11") == []
+    assert parser._need == 4
+    [tlv] = parser.feed(bytearray(b"\x22\x9F"))
+    assert tlv.Value == "11 22"
+    assert parser.rest == "9F"
+    try:
+        parser.close()
+    except MatchingFailure:
+        pass
+    else:
+        assert False, "MatchingFailure not raised"
+
+    # the repeater bounds are respected
+    parser = T3Repeater(Tlv, minimum = 2, maximum = 2).push_parser()
+    assert len(parser.feed("01 00 02 00 03 00")) == 2
+    assert parser.rest == "03 00"
+    try:
+        parser.feed("04 00")
+    except ValueError:
+        pass
+    else:
+        assert False, "ValueError not raised"
+    assert parser.rest == "03 00"
+    parser.close()
+    # errors of size callbacks are not taken for missing data
+    T = T3Table().add(1, Tag = 0).add(lambda t, data: [][0], Data = 0)
+    try:
+        T.push_parser().feed("01 02")
+    except IndexError:
+        pass
+    else:
+        assert False, "IndexError not raised"
+    parser = T3Repeater(Tlv, minimum = 2).push_parser()
+    parser.feed("01 00")
+    try:
+        parser.close()
+    except MatchingFailure:
+        pass
+    else:
+        assert False, "MatchingFailure not raised"
+
+    # feeding exactly the missing bytes doesn't read beyond a table
+    parser = Tlv.push_parser()
+    stream = bytearray(data.ascii())
+    pos    = 0
+    for tlv in tlvs:
+        while True:
+            k = parser.missing
+            tables = parser.feed(stream[pos:pos+k])
+            pos+=k
+            if tables:
+                break
+        assert Hex(tables[0]) == Hex(tlv)
+        assert len(parser) == 0
+    assert pos == len(stream)
+    from io import BytesIO
+    f = BytesIO(b"\x01\x02\x11\x22\x9F\x10\x01\x33\x02\x00")
+    tlv = Tlv.read_from(f)
+    assert tlv.Value == "11 22" and f.tell() == 4
+    assert [Hex(tlv) for tlv in T3Repeater(Tlv, maximum = 1).iter_from(f)] == ["9F 10 01 33"]
+    assert f.tell() == 8
+    assert [Hex(tlv) for tlv in T3Repeater(Tlv).iter_from(f)] == ["02 00"]
+    assert Tlv.read_from(f) is None
+
+    # tables which end with an unbounded pattern are completed by close()
+    T = T3Table().add("01", Tag = "01").add("*", Data = 0)
+    parser = T.push_parser()
+    assert parser.feed("01 02") == []
+    assert parser.feed("03") == []
+    [t] = parser.close()
+    assert t.Data == "02 03"
+
+def test_iterparse():
+    import io
+    Tlv  = _build_tlv()
+    data = Hex("01 02 11 22 9F 10 01 33 02 81 81 "+"44"*0x81+" 03 00")
+    tlvs = [Hex(tlv) for tlv in T3Repeater(Tlv) << data]
+    for source in (data, bytearray(data.ascii()), io.BytesIO(data.ascii())):
+        for chunksize in (1, 5, 4096):
+            it = T3Repeater(Tlv).iterparse(source, chunksize)
+            assert [Hex(tlv) for tlv in it] == tlvs
+            assert it.offset == len(data)
+            if hasattr(source, "seek"):
+                source.seek(0)
+
+    # iteration ends at a mismatch or at the maximum
+    it = T3Repeater(Tlv).iterparse(data[:4] // Hex("05 03 00"))
+    assert len(list(it)) == 1 and it.offset == 4
+    it = T3Repeater(Tlv, maximum = 2).iterparse(data, 3)
+    assert len(list(it)) == 2 and it.offset == 8
+    try:
+        list(T3Repeater(Tlv, minimum = 5).iterparse(data))
+    except MatchingFailure:
+        pass
+    else:
+        assert False, "MatchingFailure not raised"
+
+def test_parse_file():
+    import tempfile
+    Tlv  = _build_tlv()
+    data = Hex("01 02 11 22 9F 10 01 33 02 81 81 "+"44"*0x81+" 03 00")
+    fd, path = tempfile.mkstemp()
+    try:
+        os.write(fd, bytearray(data.ascii()))
+        os.close(fd)
+        tlvs = T3Repeater(Tlv).parse_file(path)
+        assert [Hex(tlv) for tlv in tlvs] == [Hex(tlv) for tlv in T3Repeater(Tlv) << data]
+        assert isinstance(tlvs[2].Value, HexView)
+        assert tlvs[2].Value == "44"*0x81
+        tlvs[2].Value = "55"
+        assert tlvs[2].Len == 1 and not isinstance(tlvs[2].Value, HexView)
+        tlv = Tlv.parse_file(path)
+        assert tlv.Value == "11 22"
+    finally:
+        os.remove(path)
+
+    # matching doesn't convert the whole buffer
+    view = HexView.frombuffer(bytearray(data.ascii()))
+    assert len(T3Repeater(Tlv) << view) == 4
+    assert view._s is None
+
+def test_projection():
+    Hdr = T3Table()
+    Hdr.add(1, Seq = 0)
+    Hdr.add(2, Date = 0)
+    Rec = T3Table()
+    Rec.add("A5", Magic = "A5")
+    Rec.add(Hdr, Hdr = Hdr)
+    Rec.add(1, Len = 0)
+    Rec.add(lambda rec, data: rec.Len.number(), Data = 0)
+    Rec.add(4, Amount = 0)
+    data = Hex("A5 07 11 12 02 AA BB 00 00 01 00")
+    full = Rec << data
+
+    m = Rec.match(data, fields = ["Amount"])
+    rec = m.value
+    assert not m.fail and not m.rest
+    assert isinstance(rec["Hdr"].value, T3LazyValue)
+    assert rec.Amount == full.Amount == 0x100
+    assert rec.Hdr.Date == 0x1112 and rec.Hdr._parent is rec
+    assert not isinstance(rec["Hdr"].value, T3LazyValue)
+    assert Hex(rec) == data
+    rec = Rec.match(data, fields = ["Hdr.Seq"]).value
+    assert rec.Hdr.Seq == 7 and Hex(rec) == data
+
+    # skipped fields are still validated by their sizes
+    assert Rec.match(data[:-1], fields = ["Magic"]).fail
+    assert Rec.match(Hex("A6")+data[1:], fields = ["Amount"]).fail
+
+    recs = T3Repeater(Rec).match(data // data, fields = ["Amount"]).value
+    assert [r.Amount for r in recs] == [0x100, 0x100]
+    assert [Hex(r) for r in recs] == [data, data]
+
+    # sets and bitmaps build all of their fields
+    A = T3Table().add("01", Tag = "01").add(1, V = 0)
+    B = T3Table().add("02", Tag = "02").add(1, V = 0)
+    S = T3Set().add(0x01, A = A).add(0x02, B = B)
+    sets = T3Repeater(S).match("02 05 01 06 01 07", fields = ["A"]).value
+    assert [Hex(x) for x in sets] == ["02 05 01 06", "01 07"]
+    Flags = T3Bitmap().add(4, A = 0).add(4, B = 0)
+    assert T3Repeater(Flags).match(Hex("12 34"), fields = ["A"]).value[1].B == 4
+    Msg = T3Table().add(1, Kind = 0).add(T3Repeater(S), Items = 0)
+    msg = Msg.match("07 01 06 02 05", fields = ["Kind"]).value
+    assert isinstance(msg["Items"].value, T3LazyValue)
+    assert msg.Kind == 7 and msg.Items[0].B.V == 5
+
 def test_atr():
     print("call: test_atr()")
     def get_frequency(value):
@@ -1339,20 +3163,20 @@ def test_btmp():
     
 
 def test_cyclic():    
+    # circular bindings are rejected when they are added
     T = T3Table()    
-    T.add(1, A = T3Binding(len, "A"))
-    T << "01"
     try:
-        T.A
+        T.add(1, A = T3Binding(len, "A"))
+        assert False, "RuntimeError exception not raised"
     except RuntimeError as e:
         assert str(e) == "Circular binding can't be resolved", str(e)
+    assert len(T) == 0
 
     T = T3Table()    
     T.add(1, A = T3Binding(len, "B"))
-    T.add(1, B = T3Binding(len, "A"))
-    T << "01 01"
     try:
-        T.A
+        T.add(1, B = T3Binding(len, "A"))
+        assert False, "RuntimeError exception not raised"
     except RuntimeError as e:        
         assert str(e) == "Circular binding can't be resolved", str(e)
 
@@ -1377,17 +3201,39 @@ def test_cyclic():
     assert T.K == 3
     assert T.A == 1
 
+    # bindings are evaluated in dependency order
+    assert [T._fields[i].name for i in T._bindings] == list("KJIHGFEDCBA")
+
     # now make T circular
-    U = T(L = T3Field(pattern = 1, name = "L", value_binding = T3Binding(len, "A")))
     try:
-        U.A
+        T(L = T3Field(pattern = 1, name = "L", value_binding = T3Binding(len, "A")))
+        assert False, "RuntimeError exception not raised"
+    except RuntimeError as e:        
+        assert str(e) == "Circular binding can't be resolved", str(e)
+    try:
+        T.L = T3Binding(len, "A")
+        assert False, "RuntimeError exception not raised"
     except RuntimeError as e:        
         assert str(e) == "Circular binding can't be resolved", str(e)
+    assert T.L == "01 02 03" and T.A == 1
     
 
 if __name__ == '__main__':
     test_tlv()
     test_set()
+    test_fieldindex()
+    test_field_schema()
+    test_pathcopy()
+    test_invalidate()
+    test_batch()
+    test_span()
+    test_reserialize()
+    test_packrat()
+    test_finditer()
+    test_push_parser()
+    test_iterparse()
+    test_parse_file()
+    test_projection()
     test_apdu()
     test_empty_match()
     test_list()